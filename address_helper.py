@@ -1,5 +1,6 @@
 import math
 import copy
+import functools
 import os
 import utils.hex_utils as hu
 
@@ -106,6 +107,20 @@ def address_to_byte_level(addr: int) -> list[int]:
     return results[::-1]
 
 
+# copy workloads revisit the same rows, keep recent decodes in a bounded LRU cache
+g_level_cache_size = 1 << 16
+
+
+@functools.lru_cache(maxsize=g_level_cache_size)
+def cached_byte_level(addr: int) -> tuple:
+    return tuple(address_to_byte_level(addr))
+
+
+# hits, misses, maxsize, currsize of the decode cache
+def level_cache_info():
+    return cached_byte_level.cache_info()
+
+
 def mask_address(addr: int) -> int:
     return addr & ((1 << g_bits_matters_mask) - 1)
 
@@ -138,7 +153,8 @@ def save_to_file(array, file_path, append = False):
 
 
 # validate instr format, check two addresses are in the same subarray
-def convert_each_line(line: str):
+# mapping: an address_mapping object, None checks with the linear bit slicing above
+def convert_each_line(line: str, mapping=None):
     items = line.split()
     size = len(items)
     if size < 2 or size > 3:
@@ -159,13 +175,18 @@ def convert_each_line(line: str):
     # convert
     if "RC" == mem_operation:
         # check two row are in the same subarray
-        addr_1_block_levels = address_to_block_level(addr_1)
-        addr_2_block_levels = address_to_block_level(addr_2)
+        if mapping is None:
+            addr_1_block_levels = address_to_block_level(addr_1)
+            addr_2_block_levels = address_to_block_level(addr_2)
+            subarray_id_1 = (addr_1 >> g_subarray_offset) & (g_subarray_size - 1)
+            subarray_id_2 = (addr_2 >> g_subarray_offset) & (g_subarray_size - 1)
+        else:
+            addr_1_block_levels = mapping.levels(mask_address(addr_1))
+            addr_2_block_levels = mapping.levels(mask_address(addr_2))
+            subarray_id_1 = mapping.subarray_key(mask_address(addr_1))
+            subarray_id_2 = mapping.subarray_key(mask_address(addr_2))
         bank_1 = addr_1_block_levels[g_row_level_index - 1]
         bank_2 = addr_2_block_levels[g_row_level_index - 1]
-
-        subarray_id_1 = (addr_1 >> g_subarray_offset) & (g_subarray_size - 1)
-        subarray_id_2 = (addr_2 >> g_subarray_offset) & (g_subarray_size - 1)
         rc_result = (
             "[{}]>{} {} >> bank-sub-row [{},{},{}] to bank-sub-row [{},{},{}]".format(
                 mem_operation,
@@ -203,27 +224,27 @@ def convert_each_line(line: str):
             )
         return rc_result
     else:
-        address_block_levels = (
-            address_to_block_level(int(items[2]))
-            if mem_operation == "WR"
-            else address_to_block_level(addr_1)
-        )
+        addr = int(items[2]) if mem_operation == "WR" else addr_1
+        if mapping is None:
+            address_block_levels = address_to_block_level(addr)
+        else:
+            address_block_levels = mapping.levels(mask_address(addr))
         return result.format(mem_operation, address_block_levels, "")
 
 
-def traces_file_to_block(file_path: str):
+def traces_file_to_block(file_path: str, mapping=None):
     with open(file_path, "r") as file:
         for line in file:
-            print(convert_each_line(line))
+            print(convert_each_line(line, mapping))
 
 
-def traces_array_to_block(traces, save_file: str):
+def traces_array_to_block(traces, save_file: str, mapping=None):
     directory = os.path.dirname(save_file)
     if directory and not os.path.exists(directory):
         os.makedirs(directory)
     with open(save_file, "w") as file:
         for line in traces:
-            file.write(convert_each_line(line) + "\n")
+            file.write(convert_each_line(line, mapping) + "\n")
 
 
 def address_files_to_byte_level(file_path: str):
@@ -374,4 +395,5 @@ def gen_multiple_traces():
 
 
 # main()
-gen_multiple_traces()
+if __name__ == "__main__":
+    gen_multiple_traces()
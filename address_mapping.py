@@ -0,0 +1,259 @@
+import numpy as np
+
+import address_helper as ah
+
+"""
+Pluggable physical address -> DRAM location mappings. address_helper hard-wires the linear
+bank|row|column slicing of g_assemble_levels_bits; a mapping object makes it a parameter:
+    @ LinearMapping: the current layout, channel|rank|bank|row|column
+    @ XorBankMapping: bank bits XORed with the parity of selected row bits
+    @ PermutationMapping: permutation-based page interleaving, bank ^= low row bits
+    @ ChannelInterleaveMapping: channel and rank bits inside the column, cache line grain
+Every mapping decodes/encodes a single address and NumPy arrays of addresses, and encode is
+the exact inverse of decode. Subarray keys decide RowClone eligibility in the converters.
+The cache lines of a row stay the physical page (base + cl << tx_offset), a mapping only
+changes which channel/rank/bank/row they land in.
+"""
+
+g_fields = ["channel", "rank", "bank", "row", "column"]
+
+
+class BitSliceMapping:
+    # layout: (field, bits) from the most to the least significant bit, a field may be
+    # split into several slices, its value is the concatenation of its slices in order
+    def __init__(self, name: str, layout: list):
+        self.name = name
+        self.layout = layout
+        self.field_bits = {field: 0 for field in g_fields}
+        for field, bits in layout:
+            if field not in self.field_bits:
+                raise Exception("Error mapping field: {}".format(field))
+            self.field_bits[field] += bits
+        self.total_bits = sum(bits for _, bits in layout)
+        # callers mask addresses with mask_address, wider layouts would never see their top bits
+        if self.total_bits != ah.g_bits_matters_mask:
+            raise Exception(
+                "Error mapping {}: {} bits, addresses have {}".format(
+                    name, self.total_bits, ah.g_bits_matters_mask
+                )
+            )
+        # (field, address shift, width, shift inside the field value)
+        self.slices = []
+        address_shift = self.total_bits
+        used = {field: self.field_bits[field] for field in g_fields}
+        for field, bits in layout:
+            address_shift -= bits
+            used[field] -= bits
+            self.slices.append((field, address_shift, bits, used[field]))
+        self.subarray_shift = int(np.log2(ah.g_subarray_size))
+
+    def decode_raw(self, addr):
+        values = {field: addr * 0 for field in g_fields}
+        for field, shift, bits, inner in self.slices:
+            if bits:
+                values[field] = values[field] | (
+                    ((addr >> shift) & ((1 << bits) - 1)) << inner
+                )
+        return values
+
+    def encode_raw(self, values):
+        addr = 0
+        for field, shift, bits, inner in self.slices:
+            if bits:
+                addr = addr | (((values[field] >> inner) & ((1 << bits) - 1)) << shift)
+        return addr
+
+    def bank_hash(self, values):
+        # bank bits that are XORed into the stored bank field, 0 for plain slicing
+        return 0
+
+    # works on int and on NumPy integer arrays
+    def decode(self, addr) -> dict:
+        values = self.decode_raw(addr & ((1 << self.total_bits) - 1))
+        values["bank"] = values["bank"] ^ self.bank_hash(values)
+        return values
+
+    def encode(self, values: dict):
+        stored = dict(values)
+        stored["bank"] = values["bank"] ^ self.bank_hash(values)
+        return self.encode_raw(stored)
+
+    def decode_array(self, addrs) -> dict:
+        return self.decode(np.asarray(addrs, dtype=np.int64))
+
+    def encode_array(self, values: dict):
+        return self.encode(
+            {field: np.asarray(values[field], dtype=np.int64) for field in g_fields}
+        )
+
+    def subarray_key(self, addr):
+        values = self.decode(addr)
+        key = values["channel"]
+        key = (key << self.field_bits["rank"]) | values["rank"]
+        key = (key << self.field_bits["bank"]) | values["bank"]
+        key = (key << (self.field_bits["row"] - self.subarray_shift)) | (
+            values["row"] >> self.subarray_shift
+        )
+        return key
+
+    def subarray_key_array(self, addrs):
+        return self.subarray_key(np.asarray(addrs, dtype=np.int64))
+
+    def same_subarray(self, addr_1: int, addr_2: int) -> bool:
+        return self.subarray_key(addr_1) == self.subarray_key(addr_2)
+
+    # [channel, rank, bank, row, column] like address_helper levels
+    def levels(self, addr: int) -> list[int]:
+        values = self.decode(addr)
+        return [int(values[field]) for field in g_fields]
+
+
+class LinearMapping(BitSliceMapping):
+    def __init__(self):
+        super().__init__("linear", list(zip(g_fields, ah.g_assemble_levels_bits)))
+
+
+def parity(values, mask: int):
+    result = values * 0
+    bit = 0
+    while mask >> bit:
+        if (mask >> bit) & 1:
+            result = result ^ ((values >> bit) & 1)
+        bit += 1
+    return result
+
+
+class XorBankMapping(BitSliceMapping):
+    # bank bit i ^= parity(row & row_masks[i]); the hash only reads the row, so it is
+    # undone by the same XOR on encode
+    def __init__(self, row_masks: list = None, base_layout: list = None, name="xor"):
+        super().__init__(
+            name, base_layout or list(zip(g_fields, ah.g_assemble_levels_bits))
+        )
+        if row_masks is None:
+            # every third row bit folds into one bank bit
+            row_masks = [
+                sum(
+                    1 << bit
+                    for bit in range(
+                        idx, self.field_bits["row"], self.field_bits["bank"]
+                    )
+                )
+                for idx in range(self.field_bits["bank"])
+            ]
+        if len(row_masks) != self.field_bits["bank"]:
+            raise Exception("Error: need one row mask per bank bit")
+        self.row_masks = row_masks
+
+    def bank_hash(self, values):
+        result = values["row"] * 0
+        for idx, mask in enumerate(self.row_masks):
+            result = result | (parity(values["row"], mask) << idx)
+        return result
+
+
+class PermutationMapping(XorBankMapping):
+    # Zhang et al. permutation-based page interleaving: bank ^= row low bits
+    def __init__(self, base_layout: list = None):
+        bank_bits = ah.g_bank_bits
+        super().__init__(
+            [1 << idx for idx in range(bank_bits)], base_layout, "permutation"
+        )
+
+
+class ChannelInterleaveMapping(BitSliceMapping):
+    # rank|bank|row|column_hi|channel|column_lo in the same address width: rank takes the
+    # top row bits and channel takes column bits, consecutive cache line groups alternate
+    # channels, `interleave_bits` is the byte granularity of the channel switch
+    def __init__(
+        self, channel_bits: int = 1, rank_bits: int = 1, interleave_bits: int = 6
+    ):
+        column_bits = ah.g_assemble_levels_bits[4]
+        super().__init__(
+            "channel{}_rank{}".format(1 << channel_bits, 1 << rank_bits),
+            [
+                ("rank", rank_bits),
+                ("bank", ah.g_bank_bits),
+                ("row", ah.g_rows_bit - rank_bits),
+                ("column", column_bits - interleave_bits - channel_bits),
+                ("channel", channel_bits),
+                ("column", interleave_bits),
+            ],
+        )
+
+
+def default_mappings() -> list:
+    return [
+        LinearMapping(),
+        XorBankMapping(),
+        PermutationMapping(),
+        ChannelInterleaveMapping(),
+    ]
+
+
+def load_pairs(file_path: str):
+    # raw copy trace: read src / write dst lines
+    reads = []
+    writes = []
+    with open(file_path, "r") as file:
+        for line in file:
+            items = line.split()
+            if len(items) == 2:
+                reads.append(int(items[1]))
+            elif len(items) == 3:
+                writes.append(int(items[2]))
+    size = min(len(reads), len(writes))
+    return np.array(reads[:size], dtype=np.int64), np.array(
+        writes[:size], dtype=np.int64
+    )
+
+
+# bank conflicts of an expanded stream, one open row per bank
+def bank_conflicts(mapping: BitSliceMapping, addrs) -> int:
+    values = mapping.decode_array(addrs)
+    bank = (
+        (values["channel"] << (mapping.field_bits["rank"] + mapping.field_bits["bank"]))
+        | (values["rank"] << mapping.field_bits["bank"])
+        | values["bank"]
+    )
+    order = np.argsort(bank, kind="stable")
+    bank = bank[order]
+    row = values["row"][order]
+    same_bank = bank[1:] == bank[:-1]
+    return int(np.count_nonzero(same_bank & (row[1:] != row[:-1])))
+
+
+# RowClone eligibility and bank conflicts of each mapping on the same raw copy trace
+def compare_mappings(file_path: str, mappings: list = None):
+    mappings = mappings or default_mappings()
+    reads, writes = load_pairs(file_path)
+    reads &= (1 << ah.g_bits_matters_mask) - 1
+    writes &= (1 << ah.g_bits_matters_mask) - 1
+    row_mask = ~np.int64((1 << ah.g_assemble_levels_bits[4]) - 1)
+    lines = np.arange(ah.g_cache_line_num_in_page, dtype=np.int64) << ah.g_tx_offset
+    # read row then write row, 64 cache lines each, like simple_split_to64
+    stream = np.stack([reads & row_mask, writes & row_mask], axis=1)
+    stream = (stream[:, :, None] + lines[None, None, :]).ravel()
+    results = []
+    for mapping in mappings:
+        eligible = (
+            mapping.subarray_key_array(reads) == mapping.subarray_key_array(writes)
+        ) & (mapping.decode_array(reads)["row"] != mapping.decode_array(writes)["row"])
+        result = {
+            "mapping": mapping.name,
+            "copies": int(reads.size),
+            "rowclone_eligible": int(np.count_nonzero(eligible)),
+            "bank_conflicts": bank_conflicts(mapping, stream),
+            "requests": int(stream.size),
+        }
+        results.append(result)
+        print(
+            "{}: rowclone eligible {}/{}, bank conflicts {}/{}".format(
+                result["mapping"],
+                result["rowclone_eligible"],
+                result["copies"],
+                result["bank_conflicts"],
+                result["requests"],
+            )
+        )
+    return results
@@ -0,0 +1,278 @@
+import concurrent.futures
+import os
+import time
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+
+import converter as cv
+from instrument import ConvertStats
+from trace_sink import TraceSink
+
+"""
+Batch driver for conversion sweeps. The nested loops of create_cache_traces_for_ramulator2
+(baselines x cases x limits) and batch_convert_to4line are expanded into independent jobs that
+run on a process pool:
+    @ largest input first, so the long jobs do not end up alone at the tail
+    @ at most `max_large_jobs` jobs above `large_rows` run at the same time to cap memory
+    @ every job returns its counters, a failing job or a dead worker process is reported
+      and the others go on in a new pool
+"""
+
+# same baselines as create_cache_traces_for_ramulator2: (replace_with_rowclone, mode)
+g_baselines = {
+    "c": (False, "unmap"),
+    "m": (True, "unmap"),
+    "rr": (True, "map"),
+}
+
+
+class Job:
+    def __init__(self, name: str, kind: str, args: dict, rows: int):
+        self.name = name
+        self.kind = kind
+        self.args = args
+        # input rows the job handles, used for ordering and the memory cap
+        self.rows = rows
+
+
+def count_lines(file_path: str) -> int:
+    with open(file_path, "rb") as file:
+        return sum(
+            chunk.count(b"\n") for chunk in iter(lambda: file.read(1 << 20), b"")
+        )
+
+
+def cache_trace_jobs(
+    baselines: list = None,
+    cases: range = range(6),
+    limits: list = None,
+    alternant: bool = True,
+    output_root: str = "output/convert/",
+) -> list[Job]:
+    limits = limits or [60000]
+    jobs = []
+    line_counts = {}
+    for baseline in baselines or list(g_baselines.keys()):
+        if baseline not in g_baselines:
+            raise Exception("error baseline!")
+        replace_with_rowclone, mode = g_baselines[baseline]
+        for case in cases:
+            trace_file = "inputs/extend4/{}4_case{}.trace".format(mode, case)
+            if trace_file not in line_counts:
+                line_counts[trace_file] = count_lines(trace_file)
+            for limit in limits:
+                # convert_to_cacheline never finishes with a limit above the trace rows
+                rows = min(limit, line_counts[trace_file])
+                outfile = "{}_case{}.trace".format(baseline, case)
+                if len(limits) > 1:
+                    outfile = "{}_case{}_{}.trace".format(baseline, case, limit)
+                jobs.append(
+                    Job(
+                        "{}_case{}_{}".format(baseline, case, limit),
+                        "cache_trace",
+                        {
+                            "trace_file": trace_file,
+                            "limit": rows,
+                            "alternant": alternant,
+                            "replace_with_rowclone": replace_with_rowclone,
+                            "output_path": output_root
+                            + "{}_cases/".format(baseline)
+                            + outfile,
+                        },
+                        rows,
+                    )
+                )
+    return jobs
+
+
+def convert4line_jobs(cases: range = range(6)) -> list[Job]:
+    jobs = []
+    for idx in cases:
+        for mode in ["map", "unmap"]:
+            file_path = "inputs/{}_case{}.trace".format(mode, idx)
+            jobs.append(
+                Job(
+                    "{}4_case{}".format(mode, idx),
+                    "convert4line",
+                    {
+                        "file_path": file_path,
+                        "output_path": "inputs/extend4/{}4_case{}.trace".format(
+                            mode, idx
+                        ),
+                    },
+                    count_lines(file_path),
+                )
+            )
+    return jobs
+
+
+def run_job(job: Job) -> dict:
+    start = time.perf_counter()
+    result = {"job": job.name, "status": "ok", "rows": job.rows}
+    try:
+        if job.kind == "cache_trace":
+            args = job.args
+            stats = ConvertStats()
+            with stats, TraceSink(args["output_path"]) as sink:
+                row_clone_count, total_request, _, _, error_row_clone = (
+                    cv.convert_to_cacheline(
+                        args["trace_file"],
+                        args["limit"],
+                        args["alternant"],
+                        args["replace_with_rowclone"],
+                        sink=sink,
+                        stats=stats,
+                    )
+                )
+            result.update(
+                {
+                    "row_clones": row_clone_count,
+                    "total_request": total_request,
+                    "error_row_clone": error_row_clone,
+                    "cache_lines": sink.lines_written,
+                    "bytes": sink.bytes_written,
+                    "copy_windows": stats.copy_windows,
+                }
+            )
+        elif job.kind == "convert4line":
+            cv.convert_to4line(job.args["file_path"], job.args["output_path"])
+            result["bytes"] = os.path.getsize(job.args["output_path"])
+        else:
+            raise Exception("Error job kind: {}".format(job.kind))
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def failed_result(job: Job, error: str) -> dict:
+    return {"job": job.name, "status": "failed", "rows": job.rows, "error": error}
+
+
+def run_jobs(
+    jobs: list[Job],
+    workers: int = None,
+    large_rows: int = 1000000,
+    max_large_jobs: int = 2,
+) -> list[dict]:
+    if max_large_jobs < 1:
+        raise Exception(
+            "Error max_large_jobs: {}, large jobs would never run".format(
+                max_large_jobs
+            )
+        )
+    workers = workers or os.cpu_count() or 1
+    pending = sorted(jobs, key=lambda job: job.rows, reverse=True)
+    running = {}
+    results = []
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        while pending or running:
+            running_large = sum(1 for job in running.values() if job.rows >= large_rows)
+            # fill free workers, skip large jobs while the large slots are taken
+            idx = 0
+            broken = False
+            while len(running) < workers and idx < len(pending):
+                job = pending[idx]
+                if job.rows >= large_rows and running_large >= max_large_jobs:
+                    idx += 1
+                    continue
+                try:
+                    future = executor.submit(run_job, job)
+                except BrokenProcessPool:
+                    broken = True
+                    break
+                pending.pop(idx)
+                running[future] = job
+                if job.rows >= large_rows:
+                    running_large += 1
+            if not broken:
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        results.append(future.result())
+                    except BrokenProcessPool:
+                        # a worker process died, e.g. killed on OOM
+                        results.append(failed_result(job, traceback.format_exc()))
+                        broken = True
+                    except Exception:
+                        results.append(failed_result(job, traceback.format_exc()))
+            if broken:
+                # a dead worker breaks the whole pool, the jobs still running on it
+                # are lost; start a new pool for the pending ones
+                for future, job in running.items():
+                    future.cancel()
+                    results.append(
+                        failed_result(
+                            job, "worker pool broken by a dead worker process"
+                        )
+                    )
+                running = {}
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown()
+    order = {job.name: idx for idx, job in enumerate(jobs)}
+    results.sort(key=lambda result: order[result["job"]])
+    return results
+
+
+g_summary_columns = [
+    "job",
+    "status",
+    "rows",
+    "row_clones",
+    "error_row_clone",
+    "copy_windows",
+    "cache_lines",
+    "bytes",
+    "seconds",
+]
+
+
+def summary_table(results: list[dict]) -> str:
+    cells = [g_summary_columns]
+    for result in results:
+        row = []
+        for column in g_summary_columns:
+            value = result.get(column, "")
+            row.append(
+                "{:.2f}".format(value) if isinstance(value, float) else str(value)
+            )
+        cells.append(row)
+    widths = [
+        max(len(row[idx]) for row in cells) for idx in range(len(g_summary_columns))
+    ]
+    lines = [
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths))
+        for row in cells
+    ]
+    for result in results:
+        if result["status"] != "ok":
+            lines.append(
+                "{} failed:\n{}".format(result["job"], result.get("error", ""))
+            )
+    return "\n".join(lines)
+
+
+def save_summary_csv(results: list[dict], file_path: str):
+    directory = os.path.dirname(file_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(file_path, "w") as file:
+        file.write(",".join(g_summary_columns) + "\n")
+        for result in results:
+            file.write(
+                ",".join(str(result.get(column, "")) for column in g_summary_columns)
+                + "\n"
+            )
+
+
+if __name__ == "__main__":
+    results = run_jobs(cache_trace_jobs())
+    print(summary_table(results))
+    save_summary_csv(results, "output/convert/summary.csv")
@@ -1,7 +1,16 @@
+import json
 import math
+import os
+import sys
+import time
 
 import concurrent.futures
 import address_helper as ah
+from instrument import ConvertStats
+from row_ir import IROp, RowIR
+from scheduler import ReorderStage
+from trace_sink import ShardedTraceSink, TraceSink
+import window_kernel as wk
 
 
 class CMD:
@@ -10,6 +19,29 @@ class CMD:
     RC = "RC"
 
 
+# who runs the window state machine
+class Backend:
+    # CMD4Window, one method call per row
+    PYTHON = "python"
+    # window_kernel loop compiled by Numba, PYTHON is used when Numba is not installed;
+    # compare_backends checks that both give the same output
+    JIT = "jit"
+
+
+# input lines the jit backend parses per chunk, about 1M rows
+g_kernel_chunk_bytes = 32 << 20
+
+
+def check_backend(backend: str, stats: ConvertStats, log_rows: bool):
+    if backend == Backend.PYTHON:
+        return False
+    if backend != Backend.JIT:
+        raise Exception("Error backend: {}".format(backend))
+    if stats is not None or log_rows:
+        raise Exception("Error: the jit backend runs without stats or row logs")
+    return wk.g_has_numba
+
+
 class CMDLine:
 
     def __init__(self, op, addr1, addr2, bubble_count=0) -> None:
@@ -19,6 +51,38 @@ class CMDLine:
         self.bubble_count = bubble_count
 
 
+# row dump of a window, decoded from raw addresses only when someone iterates it
+class RowRequestLog:
+    def __init__(self):
+        self.rows = []
+
+    def append(self, row: CMDLine):
+        if row.op == CMD.READ:
+            self.rows.append((CMD.READ, row.addr1))
+        else:
+            self.rows.append((CMD.WRITE, row.addr2))
+
+    @staticmethod
+    def format_row(op, addr) -> str:
+        levels = list(ah.cached_byte_level(addr))
+        if op == CMD.READ:
+            return "<read>  " + str(levels)
+        return "<write>  " + str(levels)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        for op, addr in self.rows:
+            yield RowRequestLog.format_row(op, addr)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [RowRequestLog.format_row(op, addr) for op, addr in self.rows[index]]
+        op, addr = self.rows[index]
+        return RowRequestLog.format_row(op, addr)
+
+
 class CMD4Window:
     row_bits = ah.g_assemble_levels_bits[4]
     subarray_mask_bits = ah.g_assemble_levels_bits[4] + int(
@@ -26,7 +90,17 @@ class CMD4Window:
     )
     tx_offset = ah.g_tx_offset
 
-    def __init__(self, target: int, alternative: bool, replace_with_rowclone: bool):
+    def __init__(
+        self,
+        target: int,
+        alternative: bool,
+        replace_with_rowclone: bool,
+        sink: TraceSink = None,
+        stats: ConvertStats = None,
+        log_rows: bool = False,
+        ir: RowIR = None,
+        mapping=None,
+    ):
         self.win: list[CMDLine] = []
         self.cap = 4
         self.traces = []
@@ -34,9 +108,22 @@ class CMD4Window:
         self.handled_rows = 0
         self.target_row_num = target
         self.alternative = alternative
-        self.row_requests = []
+        # rows accepted into the window, up to target
+        self.row_count = 0
+        # opt-in row dump, strings are built lazily by RowRequestLog
+        self.row_log = RowRequestLog() if log_rows else None
         self.replace_with_rowclone = replace_with_rowclone
         self.error_row_clone = 0
+        # when a sink is given, cache line requests are streamed out instead of kept in traces
+        self.sink = sink
+        # opt-in instrumentation, None keeps the hot path untouched
+        self.stats = stats
+        if sink is not None and stats is not None:
+            sink.attach_stats(stats)
+        # when an IR is given, rows are recorded there and expanded later by its writer
+        self.ir = ir
+        # an address_mapping object decides the subarray, None keeps the linear bit slicing
+        self.mapping = mapping
 
     def is_full(self) -> bool:
         return len(self.win) >= self.cap
@@ -44,27 +131,93 @@ class CMD4Window:
     def is_empty(self) -> bool:
         return len(self.win) == 0
 
+    @property
+    def row_requests(self):
+        if self.row_log is None:
+            return []
+        return self.row_log
+
     def add(self, row: CMDLine):
-        if len(self.row_requests) >= self.target_row_num:
+        if self.row_count >= self.target_row_num:
             return
         self.win.append(row)
-        if row.op == CMD.READ:
-            self.row_requests.append(
-                "<read>  " + str(ah.address_to_byte_level(row.addr1))
-            )
-        else:
-            self.row_requests.append(
-                "<write>  " + str(ah.address_to_byte_level(row.addr2))
-            )
+        self.row_count += 1
+        if self.row_log is not None:
+            self.row_log.append(row)
 
     def clear(self):
         self.win.clear()
 
+    def subarray_key(self, addr: int) -> int:
+        if self.mapping is None:
+            return addr >> self.subarray_mask_bits
+        return self.mapping.subarray_key(addr)
+
+    def same_subarray(self, addr_1: int, addr_2: int) -> bool:
+        return self.subarray_key(addr_1) == self.subarray_key(addr_2)
+
+    # counters and rows still in the window, enough to continue a conversion later
+    def get_state(self) -> dict:
+        return {
+            "win": [
+                [row.op, row.addr1, row.addr2, row.bubble_count] for row in self.win
+            ],
+            "row_count": self.row_count,
+            "handled_rows": self.handled_rows,
+            "row_clone_count": self.row_clone_count,
+            "error_row_clone": self.error_row_clone,
+        }
+
+    def set_state(self, state: dict):
+        self.win.clear()
+        for op, addr1, addr2, bubble_count in state["win"]:
+            self.win.append(CMDLine(op, addr1, addr2, bubble_count))
+        self.row_count = state["row_count"]
+        self.handled_rows = state["handled_rows"]
+        self.row_clone_count = state["row_clone_count"]
+        self.error_row_clone = state["error_row_clone"]
+
     def is_finished(self):
         return self.handled_rows >= self.target_row_num
 
     def extend_traces(self, lines: list):
-        self.traces.extend(lines)
+        if self.sink is not None:
+            self.sink.extend(lines)
+        else:
+            self.traces.extend(lines)
+
+    def append_trace(self, line: str):
+        if self.sink is not None:
+            self.sink.write(line)
+        else:
+            self.traces.append(line)
+
+    def emit_row(self, row: CMDLine, dma: bool = False):
+        if self.ir is None:
+            self.extend_traces(CMD4Window.simple_split_to64(row, dma))
+        elif row.op == CMD.READ:
+            self.ir.add_row(IROp.READ, row.addr1, row.bubble_count)
+        else:
+            self.ir.add_row(
+                IROp.DMA_WRITE if dma else IROp.WRITE, row.addr2, row.bubble_count
+            )
+
+    def emit_row_pair(self, row1: CMDLine, row2: CMDLine):
+        if self.ir is None:
+            self.extend_traces(
+                CMD4Window.split_2rows_to64(row1, row2, self.alternative)
+            )
+        elif self.alternative:
+            self.ir.add_pair(row1.addr1, row2.addr2)
+        else:
+            self.emit_row(row1)
+            self.emit_row(row2)
+
+    def emit_row_clone(self, rd_addr: int, wr_addr: int):
+        if self.ir is None:
+            self.append_trace("0 {} {}".format(rd_addr, wr_addr))
+        else:
+            self.ir.add_row_clone(rd_addr, wr_addr)
 
     def split_2rows_to64(row1: CMDLine, row2: CMDLine, alternative: bool):
         cache_lines = []
@@ -131,7 +284,7 @@ class CMD4Window:
         if self.is_empty():
             return
         row1 = self.win.pop(0)
-        self.extend_traces(CMD4Window.simple_split_to64(row1))
+        self.emit_row(row1)
         self.handled_rows += 1
         return
 
@@ -139,29 +292,57 @@ class CMD4Window:
         # if yes, then check if we can replace with a rowclone
         rd_addr = self.win[1].addr1
         wr_addr = self.win[2].addr2
-        self.extend_traces(CMD4Window.simple_split_to64(self.win[0], True))
-        if (
-            self.replace_with_rowclone
-            and rd_addr >> self.subarray_mask_bits == wr_addr >> self.subarray_mask_bits
-        ):
+        self.emit_row(self.win[0], True)
+        if self.replace_with_rowclone and self.same_subarray(rd_addr, wr_addr):
             # replace with a rowclone command
             if rd_addr == wr_addr:
                 self.error_row_clone += 1
             else:
-                self.traces.append("0 {} {}".format(rd_addr, wr_addr))
+                self.emit_row_clone(rd_addr, wr_addr)
                 self.row_clone_count += 1
         else:
             # consider consecutive or alternative
-            self.extend_traces(
-                CMD4Window.split_2rows_to64(self.win[1], self.win[2], self.alternative)
-            )
+            self.emit_row_pair(self.win[1], self.win[2])
 
-        self.extend_traces(CMD4Window.simple_split_to64(self.win[3]))
+        self.emit_row(self.win[3])
         self.clear()
         self.handled_rows += 4
         return
 
+    def emitted_lines(self) -> int:
+        if self.ir is not None:
+            return self.ir.cache_lines()
+        if self.sink is not None:
+            return self.sink.total_lines()
+        return len(self.traces)
+
+    def copy_window_ready(self):
+        return self.is_copy_window() and (self.handled_rows <= self.target_row_num - 4)
+
+    def handle_with_stats(self):
+        start = time.perf_counter()
+        emitted = self.emitted_lines()
+        handled_rows = self.handled_rows
+        row_clone_count = self.row_clone_count
+        error_row_clone = self.error_row_clone
+        copy_window = self.copy_window_ready()
+        if copy_window:
+            self.handle_copy_window()
+        else:
+            self.handle_in_normal_mode()
+        self.stats.row_clones += self.row_clone_count - row_clone_count
+        self.stats.error_row_clones += self.error_row_clone - error_row_clone
+        self.stats.handle_time += time.perf_counter() - start
+        self.stats.record_window(
+            copy_window,
+            self.handled_rows - handled_rows,
+            self.emitted_lines() - emitted,
+        )
+
     def handle(self):
+        if self.stats is not None:
+            self.handle_with_stats()
+            return
         if self.is_copy_window() and (self.handled_rows <= self.target_row_num - 4):
             self.handle_copy_window()
         else:
@@ -175,11 +356,34 @@ def bulk_convert_to_cacheline(
     limit: int,
     alternative: bool,
     replace_with_rowclone: bool,
+    sink: TraceSink = None,
+    stats: ConvertStats = None,
+    log_rows: bool = False,
+    ir: RowIR = None,
+    mapping=None,
+    backend: str = Backend.PYTHON,
 ):
+    if check_backend(backend, stats, log_rows):
+        return kernel_bulk_convert_to_cacheline(
+            traces,
+            start,
+            step,
+            limit,
+            alternative,
+            replace_with_rowclone,
+            sink,
+            ir,
+            mapping,
+        )
     slide_window = CMD4Window(
         target=limit,
         alternative=alternative,
         replace_with_rowclone=replace_with_rowclone,
+        sink=sink,
+        stats=stats,
+        log_rows=log_rows,
+        ir=ir,
+        mapping=mapping,
     )
     tail = min(start + step, len(traces))
     index = start
@@ -190,6 +394,8 @@ def bulk_convert_to_cacheline(
             except Exception as ex:
                 print("error!")
             index += 1
+            if stats is not None:
+                stats.lines_parsed += 1
             arr = cmd.split()
             bubble_count = int(arr[0])
             if len(arr) == 2:
@@ -204,20 +410,107 @@ def bulk_convert_to_cacheline(
         slide_window.handle()
     return (
         slide_window.row_clone_count,
-        len(slide_window.row_requests),
+        slide_window.row_count,
         slide_window.traces,
         slide_window.row_requests,
         slide_window.error_row_clone,
     )
 
 
+# one window runs over the whole trace, a shard is closed only between two handle() calls
+def sharded_convert_to_cacheline(
+    traces: list,
+    shard_sink: ShardedTraceSink,
+    alternative: bool,
+    replace_with_rowclone: bool,
+    stats: ConvertStats = None,
+    mapping=None,
+):
+    slide_window = CMD4Window(
+        target=len(traces),
+        alternative=alternative,
+        replace_with_rowclone=replace_with_rowclone,
+        sink=shard_sink,
+        stats=stats,
+        mapping=mapping,
+    )
+    shard_start = 0
+    shard_row_clone = 0
+    shard_error_row_clone = 0
+    index = 0
+    tail = len(traces)
+    while index < tail or not slide_window.is_empty():
+        while not slide_window.is_full() and index < tail:
+            arr = traces[index].split()
+            index += 1
+            if stats is not None:
+                stats.lines_parsed += 1
+            bubble_count = int(arr[0])
+            if len(arr) == 2:
+                line = CMDLine(CMD.READ, ah.mask_address(int(arr[1])), -1, bubble_count)
+            else:
+                line = CMDLine(
+                    CMD.WRITE, -1, ah.mask_address(int(arr[2])), bubble_count
+                )
+            slide_window.add(line)
+        # at the tail we drain the window instead of dropping the last rows
+        slide_window.handle()
+        if shard_sink.should_cut():
+            # rows still in the window belong to the next shard
+            shard_end = index - len(slide_window.win)
+            shard_sink.cut(
+                shard_start,
+                shard_end,
+                slide_window.row_clone_count - shard_row_clone,
+                slide_window.error_row_clone - shard_error_row_clone,
+            )
+            shard_start = shard_end
+            shard_row_clone = slide_window.row_clone_count
+            shard_error_row_clone = slide_window.error_row_clone
+    shard_sink.cut(
+        shard_start,
+        tail,
+        slide_window.row_clone_count - shard_row_clone,
+        slide_window.error_row_clone - shard_error_row_clone,
+    )
+    return (
+        slide_window.row_clone_count,
+        slide_window.row_count,
+        slide_window.error_row_clone,
+    )
+
+
 def convert_to_cacheline(
-    file_path: str, limit: int, alternative: bool, replace_with_rowclone: bool
+    file_path: str,
+    limit: int,
+    alternative: bool,
+    replace_with_rowclone: bool,
+    sink: TraceSink = None,
+    stats: ConvertStats = None,
+    log_rows: bool = False,
+    ir: RowIR = None,
+    mapping=None,
+    backend: str = Backend.PYTHON,
 ):
+    if check_backend(backend, stats, log_rows):
+        return kernel_convert_to_cacheline(
+            file_path,
+            limit,
+            alternative,
+            replace_with_rowclone,
+            sink,
+            ir,
+            mapping,
+        )
     slide_window = CMD4Window(
         target=limit,
         alternative=alternative,
         replace_with_rowclone=replace_with_rowclone,
+        sink=sink,
+        stats=stats,
+        log_rows=log_rows,
+        ir=ir,
+        mapping=mapping,
     )
     with open(file_path, "r") as file:
         while True:
@@ -229,6 +522,8 @@ def convert_to_cacheline(
                     cmd = file.readline()
                     if cmd == "":
                         break
+                    if stats is not None:
+                        stats.lines_parsed += 1
                     arr = cmd.split()
                     if len(arr) == 1:
                         # this is a bubble count, continue to next line
@@ -255,13 +550,290 @@ def convert_to_cacheline(
                 break
     return (
         slide_window.row_clone_count,
-        len(slide_window.row_requests),
+        slide_window.row_count,
         slide_window.traces,
         slide_window.row_requests,
         slide_window.error_row_clone,
     )
 
 
+# entries of a kernel run go to the IR of the caller, a sink or the returned traces
+def emit_kernel_entries(chunk_ir: RowIR, ir: RowIR, sink: TraceSink, traces: list):
+    if ir is not None:
+        return
+    if sink is not None:
+        chunk_ir.write_to(sink)
+    else:
+        traces.extend(chunk_ir.expand())
+
+
+# bulk_convert_to_cacheline on the window_kernel backend
+def kernel_bulk_convert_to_cacheline(
+    traces: list,
+    start,
+    step,
+    limit: int,
+    alternative: bool,
+    replace_with_rowclone: bool,
+    sink: TraceSink = None,
+    ir: RowIR = None,
+    mapping=None,
+):
+    window = wk.KernelWindow(alternative, replace_with_rowclone, mapping)
+    tail = min(start + step, len(traces))
+    count = max(min(tail - start, limit), 0)
+    ops = []
+    addrs = []
+    bubbles = []
+    for index in range(start, start + count):
+        arr = traces[index].split()
+        if len(arr) == 2:
+            ops.append(wk.g_row_read)
+            addrs.append(ah.mask_address(int(arr[1])))
+        else:
+            ops.append(wk.g_row_write)
+            addrs.append(ah.mask_address(int(arr[2])))
+        bubbles.append(int(arr[0]))
+    # the slice ends with one handle() on the window holding its last row, rows that
+    # are still in the window after it are dropped
+    if tail - start <= limit:
+        last_start = count - 4
+    else:
+        last_start = count - 3
+    chunk_ir = RowIR() if ir is None else ir
+    window.run(ops, addrs, bubbles, chunk_ir, final=True, last_start=last_start)
+    results = []
+    emit_kernel_entries(chunk_ir, ir, sink, results)
+    return (
+        window.row_clone_count,
+        window.row_count,
+        results,
+        [],
+        window.error_row_clone,
+    )
+
+
+# convert_to_cacheline on the window_kernel backend, the file is parsed in chunks
+def kernel_convert_to_cacheline(
+    file_path: str,
+    limit: int,
+    alternative: bool,
+    replace_with_rowclone: bool,
+    sink: TraceSink = None,
+    ir: RowIR = None,
+    mapping=None,
+):
+    window = wk.KernelWindow(alternative, replace_with_rowclone, mapping)
+    traces = []
+    bubble_count = 0
+    with open(file_path, "r") as file:
+        while window.row_count < limit:
+            lines = file.readlines(g_kernel_chunk_bytes)
+            if not lines:
+                break
+            ops = []
+            addrs = []
+            bubbles = []
+            rows = limit - window.row_count
+            for cmd in lines:
+                arr = cmd.split()
+                if len(arr) == 1:
+                    # this is a bubble count, continue to next line
+                    bubble_count = int(arr[0])
+                    continue
+                if len(ops) == rows:
+                    break
+                if len(arr) == 2:
+                    ops.append(wk.g_row_read)
+                    addrs.append(ah.mask_address(int(arr[1])))
+                else:
+                    ops.append(wk.g_row_write)
+                    addrs.append(ah.mask_address(int(arr[2])))
+                bubbles.append(bubble_count)
+                bubble_count = 0
+            chunk_ir = RowIR() if ir is None else ir
+            window.run(ops, addrs, bubbles, chunk_ir)
+            emit_kernel_entries(chunk_ir, ir, sink, traces)
+    chunk_ir = RowIR() if ir is None else ir
+    window.run([], [], [], chunk_ir, final=True)
+    emit_kernel_entries(chunk_ir, ir, sink, traces)
+    return (
+        window.row_clone_count,
+        window.row_count,
+        traces,
+        [],
+        window.error_row_clone,
+    )
+
+
+def save_checkpoint(checkpoint_path: str, state: dict):
+    # write then rename, a kill in between leaves the previous checkpoint intact
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, checkpoint_path)
+
+
+def load_checkpoint(checkpoint_path: str) -> dict:
+    with open(checkpoint_path, "r") as file:
+        return json.load(file)
+
+
+# convert_to_cacheline that can stop and continue:
+#   @ every `checkpoint_rows` handled rows the input offset, the window, the counters, the
+#     pending bubble and the output offset are saved to checkpoint_path
+#   @ resume=True continues from the checkpoint, output after its offset is dropped
+#   @ follow=True waits for lines appended to a growing trace instead of stopping at the end
+#     of the file, the window is only handled once it is full like in a single run, and
+#     after `idle_timeout` seconds without new lines the trace is taken as complete
+# Output is identical to convert_to_cacheline on the complete trace.
+def incremental_convert_to_cacheline(
+    file_path: str,
+    output_path: str,
+    limit: int,
+    alternative: bool,
+    replace_with_rowclone: bool,
+    checkpoint_path: str = None,
+    checkpoint_rows: int = 100000,
+    resume: bool = False,
+    follow: bool = False,
+    poll_interval: float = 0.05,
+    idle_timeout: float = None,
+    mapping=None,
+):
+    settings = {
+        "file_path": file_path,
+        "output_path": output_path,
+        "limit": limit,
+        "alternative": alternative,
+        "replace_with_rowclone": replace_with_rowclone,
+    }
+    state = None
+    if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+        state = load_checkpoint(checkpoint_path)
+        if state["settings"] != settings:
+            raise Exception(
+                "Error: checkpoint {} was written with {}".format(
+                    checkpoint_path, state["settings"]
+                )
+            )
+    sink = TraceSink(output_path, append=state is not None)
+    slide_window = CMD4Window(
+        target=limit,
+        alternative=alternative,
+        replace_with_rowclone=replace_with_rowclone,
+        sink=sink,
+        mapping=mapping,
+    )
+    offset = 0
+    bubble_count = 0
+    if state is not None:
+        sink.resume(state["output_bytes"], state["output_lines"])
+        slide_window.set_state(state["window"])
+        offset = state["offset"]
+        bubble_count = state["bubble_count"]
+
+    def checkpoint():
+        if checkpoint_path is None:
+            return
+        sink.sync()
+        save_checkpoint(
+            checkpoint_path,
+            {
+                "settings": settings,
+                "offset": file.tell(),
+                "bubble_count": bubble_count,
+                "window": slide_window.get_state(),
+                "output_bytes": sink.bytes_written,
+                "output_lines": sink.lines_written,
+            },
+        )
+
+    # bytes: tell() is a plain offset and int() parses the fields as they are
+    with sink, open(file_path, "rb") as file:
+        file.seek(offset)
+        checkpoint_at = slide_window.handled_rows + checkpoint_rows
+        idle_since = None
+        waiting = follow
+        while not slide_window.is_finished():
+            at_end = False
+            while not slide_window.is_full() and not slide_window.is_finished():
+                cmd = file.readline()
+                if cmd == b"" or (waiting and not cmd.endswith(b"\n")):
+                    # a partial last line is still being written, read it again later
+                    file.seek(-len(cmd), os.SEEK_CUR)
+                    at_end = True
+                    break
+                arr = cmd.split()
+                if len(arr) == 1:
+                    # this is a bubble count, continue to next line
+                    bubble_count = int(arr[0])
+                    continue
+                elif len(arr) == 2:
+                    line = CMDLine(
+                        CMD.READ, ah.mask_address(int(arr[1])), -1, bubble_count
+                    )
+                else:
+                    line = CMDLine(
+                        CMD.WRITE, -1, ah.mask_address(int(arr[2])), bubble_count
+                    )
+                bubble_count = 0
+                slide_window.add(line)
+            if at_end and waiting:
+                if idle_since is None:
+                    # make the output so far visible and save where we are
+                    idle_since = time.monotonic()
+                    sink.sync()
+                    checkpoint()
+                if idle_timeout is None or time.monotonic() - idle_since < idle_timeout:
+                    time.sleep(poll_interval)
+                    continue
+                # nothing new for idle_timeout seconds, the trace is complete
+                waiting = False
+            idle_since = None
+            if at_end and slide_window.is_empty():
+                # fewer rows than limit, nothing left to handle
+                break
+            slide_window.handle()
+            if slide_window.handled_rows >= checkpoint_at:
+                checkpoint()
+                checkpoint_at = slide_window.handled_rows + checkpoint_rows
+        checkpoint()
+    return (
+        slide_window.row_clone_count,
+        slide_window.row_count,
+        slide_window.error_row_clone,
+    )
+
+
+# convert a case into row level IR, cache lines are only expanded by save_row_ir
+def convert_to_row_ir(
+    file_path: str,
+    limit: int,
+    alternative: bool,
+    replace_with_rowclone: bool,
+    mapping=None,
+):
+    ir = RowIR()
+    row_clone_count, total_request, _, _, error_row_clone = convert_to_cacheline(
+        file_path,
+        limit,
+        alternative,
+        replace_with_rowclone,
+        ir=ir,
+        mapping=mapping,
+    )
+    return ir, row_clone_count, total_request, error_row_clone
+
+
+def save_row_ir(ir: RowIR, output_path: str):
+    with TraceSink(output_path) as sink:
+        ir.write_to(sink)
+    return sink.lines_written, sink.bytes_written
+
+
 def convert_to_rowclone_trace(file_path: str, limit: int, alternant: bool):
     row_bits = ah.g_assemble_levels_bits[4]
     subarray_mask_bits = ah.g_assemble_levels_bits[4] + int(
@@ -410,6 +982,7 @@ def create_cache_traces_for_ramulator2():
                 # row_clone_count, total_request, traces, row_requests = (
                 #     convert_to_rowclone_trace(trace_file, limit, alternant)
                 # )
+                # pass log_rows=True when saving row_requests in step 2
                 (
                     row_clone_count,
                     total_request,
@@ -447,6 +1020,113 @@ def create_cache_traces_for_ramulator2():
                 ah.save_to_file(traces, output_dir + outfile)
 
 
+# the jit backend must give the same cache lines and counters as CMD4Window on every
+# extend4 case, for whole files and for bulk slices that end mid copy window
+def compare_backends(step: int = 9999):
+    if not wk.g_has_numba:
+        raise Exception(
+            "Error: Numba is not installed, the jit backend would run Python"
+        )
+    results = []
+    for mode in ["unmap", "map"]:
+        for case in range(6):
+            trace_file = "inputs/extend4/{}4_case{}.trace".format(mode, case)
+            with open(trace_file, "r") as file:
+                lines = [line for line in file.read().split("\n") if line]
+            for alternative in [True, False]:
+                for replace_with_rowclone in [False, True]:
+                    name = "{}4_case{} alternative {} rowclone {}".format(
+                        mode, case, alternative, replace_with_rowclone
+                    )
+                    runs = {}
+                    for backend in [Backend.PYTHON, Backend.JIT]:
+                        row_clone_count, total_request, traces, _, error_row_clone = (
+                            convert_to_cacheline(
+                                trace_file,
+                                len(lines),
+                                alternative,
+                                replace_with_rowclone,
+                                backend=backend,
+                            )
+                        )
+                        slices = [
+                            bulk_convert_to_cacheline(
+                                lines,
+                                start,
+                                step,
+                                step,
+                                alternative,
+                                replace_with_rowclone,
+                                backend=backend,
+                            )
+                            for start in range(0, len(lines), step)
+                        ]
+                        runs[backend] = (
+                            (row_clone_count, total_request, error_row_clone),
+                            traces,
+                            [(s[0], s[1], s[4]) for s in slices],
+                            [s[2] for s in slices],
+                        )
+                    python_run = runs[Backend.PYTHON]
+                    jit_run = runs[Backend.JIT]
+                    for idx, part in enumerate(
+                        [
+                            "counters",
+                            "cache lines",
+                            "slice counters",
+                            "slice cache lines",
+                        ]
+                    ):
+                        if python_run[idx] != jit_run[idx]:
+                            raise Exception(
+                                "Error: jit backend {} differ on {}".format(part, name)
+                            )
+                    print(
+                        "{}: identical, row clone {}, {} cache lines".format(
+                            name, python_run[0][0], len(python_run[1])
+                        )
+                    )
+                    results.append([name, python_run[0], len(python_run[1])])
+                    del runs, python_run, jit_run
+    return results
+
+
+# stream one case straight into Ramulator2 through a FIFO or stdout ("-"), no output/ file
+def stream_cache_traces_for_ramulator2(
+    trace_file: str,
+    sink_path: str,
+    limit: int,
+    alternant: bool,
+    replace_with_rowclone: bool,
+    make_fifo: bool = False,
+    stats: ConvertStats = None,
+    sched_policy: str = None,
+    sched_window: int = 256,
+):
+    sink = TraceSink(sink_path, make_fifo=make_fifo)
+    if sched_policy is not None:
+        # reorder cache line requests across banks before they reach the consumer
+        sink = ReorderStage(sink, sched_policy, sched_window)
+    with sink:
+        (
+            row_clone_count,
+            total_request,
+            _,
+            _,
+            error_row_clone,
+        ) = convert_to_cacheline(
+            trace_file, limit, alternant, replace_with_rowclone, sink=sink, stats=stats
+        )
+    # keep stdout clean for the trace itself
+    print(
+        "row clone request is {}, total request is {}, error row clone is {}, streamed lines {}".format(
+            row_clone_count, total_request, error_row_clone, sink.total_lines()
+        ),
+        file=sys.stderr,
+    )
+    return row_clone_count, total_request, error_row_clone
+
+
 def add_line_at_head(file_path, content):
     with open(file_path, "r+") as file:
         # Read the current content of the file
@@ -479,7 +1159,21 @@ def replace_bubble_count_expand4(file_path):
     return assembles
 
 
-def rb_all_in_one(path_file):
+# bubbled4 rows [start, end) to the [start, end) lines of the original trace, 3 lines
+# (bubble, read, write) become 4 rows, a shard ending inside a group shares that group
+# with the next shard
+def bubbled4_to_source_lines(start: int, end: int):
+    return 3 * (start // 4), 3 * -(-end // 4)
+
+
+def rb_all_in_one(
+    path_file,
+    sink_path: str = None,
+    make_fifo: bool = False,
+    shard_requests: int = None,
+    shard_bytes: int = None,
+    stats: ConvertStats = None,
+):
     # first, we have original trace like: we have to replace 0 with bubble count
     # ----------------------------------
     #        0------row1
@@ -490,8 +1184,11 @@ def rb_all_in_one(path_file):
     #        bubble_count
     bubbled4 = replace_bubble_count_expand4(path_file)
     output_dir = "./output/"
-    bubbled4_file = output_dir + "bubbled4.trace"
-    ah.save_to_file(bubbled4, bubbled4_file)
+    sharded = shard_requests is not None or shard_bytes is not None
+    if sink_path is None and not sharded:
+        # streamed and sharded runs convert from memory, no scratch copy on disk
+        bubbled4_file = output_dir + "bubbled4.trace"
+        ah.save_to_file(bubbled4, bubbled4_file)
     # Now we have intermediate trace like: then we slice into cache line request
     #        bubble_count--- -1 ---row1
     #        0------------row1
@@ -505,6 +1202,52 @@ def rb_all_in_one(path_file):
     step = 500000
     start = 0
     chip = 1
+    if sharded:
+        # balanced shards by output size, listed in output/manifest.json
+        shard_sink = ShardedTraceSink(
+            output_dir,
+            target_requests=shard_requests,
+            target_bytes=shard_bytes,
+        )
+        row_clone_count, total_request, error_row_clone = sharded_convert_to_cacheline(
+            bubbled4, shard_sink, False, replace_with_rowclone, stats
+        )
+        # shard ranges point into the in-memory bubbled4 rows, the manifest lists path_file
+        for shard in shard_sink.shards:
+            shard["input_start"], shard["input_end"] = bubbled4_to_source_lines(
+                shard["input_start"], shard["input_end"]
+            )
+        manifest_path = shard_sink.write_manifest(path_file)
+        print(
+            f"{len(shard_sink.shards)} shards in {manifest_path} :row clone request is {row_clone_count}, total request is {total_request}, error row clone is {error_row_clone}"
+        )
+        return
+    if sink_path is not None:
+        # all slices go to one stream in order, the consumer sees a single trace
+        with TraceSink(sink_path, make_fifo=make_fifo) as sink:
+            while start < len(bubbled4):
+                (
+                    row_clone_count,
+                    total_request,
+                    _,
+                    _,
+                    error_row_clone,
+                ) = bulk_convert_to_cacheline(
+                    bubbled4,
+                    start,
+                    step,
+                    100000000,
+                    False,
+                    replace_with_rowclone,
+                    sink,
+                    stats,
+                )
+                print(
+                    f"slice from {start} :row clone request is {row_clone_count}, total request is {total_request}, error row clone is {error_row_clone}",
+                    file=sys.stderr,
+                )
+                start += step
+        return
     write_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
     while start < len(bubbled4):
         (
@@ -514,7 +1257,7 @@ def rb_all_in_one(path_file):
             _,
             error_row_clone,
         ) = bulk_convert_to_cacheline(
-            bubbled4, start, step, 100000000, False, replace_with_rowclone
+            bubbled4, start, step, 100000000, False, replace_with_rowclone, stats=stats
         )
         print(
             f"slice from {start} :row clone request is {row_clone_count}, total request is {total_request}, error row clone is {error_row_clone}"
@@ -528,6 +1271,10 @@ def rb_all_in_one(path_file):
     return
 
 
-trace_path = "./inputs/baseline.trace"
-rb_all_in_one(trace_path)
-# create_cache_traces_for_ramulator2()
+if __name__ == "__main__":
+    trace_path = "./inputs/baseline.trace"
+    rb_all_in_one(trace_path)
+    # create_cache_traces_for_ramulator2()
+    # stream_cache_traces_for_ramulator2(
+    #     "inputs/extend4/unmap4_case0.trace", "output/ramulator2.fifo", 60000, True, True, True
+    # )
@@ -1,52 +1,134 @@
-# idd01=10
-# idd02=65
-# idd2n1=3
-# idd2n2=26.5
-# idd3n1=3
-# idd3n2=32
-# idd4r=8.5
-# idd4r2=420
-# idd4w1=3
-# idd4w2=435
-# vdd1=1.8
-# vdd2=1.1
-
-tRAS = 68
-tRP = 29
-rho = 42.5 / 41.07
-tRCD = 29
-tCCD = 8
-tRTP = 12
-tWL = 14
-tWR = 30
-BL = 8
+import numpy as np
 
-def energy():
-    vdd = [1.8, 1.1]
-    idd0 = [10, 65]
-    idd2n = [3, 26.5]
-    idd3n = [3, 32]
-    idd4r = [8.5, 420]
-    idd4w = [3, 435]
-    tck = 0.625
-
-    bg_pre_cycles = (
-        (tRCD + 64 * tCCD + tRTP) * 2 + tRCD + 64 * tCCD + tWL + tWR + BL + 2
-    )
-    bg_act_cycles = (   
-        (tRCD + 64 * tCCD + 2 * tRTP) * 2 + tRCD + 64 * tCCD + tWL + tWR + BL + 2 + tRP
+"""
+Energy of one copy (2 row reads + 1 row write in cache line grain, plus the rowclone
+activate/precharge overhead) per power rail. Every parameter broadcasts, pass NumPy arrays to
+evaluate a whole sensitivity grid in one call. Rail parameters are suffixed with the rail
+index: vdd1 is the 1.8V rail, vdd2 the 1.1V rail.
+"""
+
+g_energy_params = {
+    "idd01": 10,
+    "idd02": 65,
+    "idd2n1": 3,
+    "idd2n2": 26.5,
+    "idd3n1": 3,
+    "idd3n2": 32,
+    "idd4r1": 8.5,
+    "idd4r2": 420,
+    "idd4w1": 3,
+    "idd4w2": 435,
+    "vdd1": 1.8,
+    "vdd2": 1.1,
+    "tck": 0.625,
+    "tRAS": 68,
+    "tRP": 29,
+    "rho": 42.5 / 41.07,
+    "tRCD": 29,
+    "tCCD": 8,
+    "tRTP": 12,
+    "tWL": 14,
+    "tWR": 30,
+    "BL": 8,
+}
+g_rails = [1, 2]
+g_energy_components = ["bg_pre", "bg_act", "read", "write", "act_pre", "row_clone"]
+
+
+# evaluate the model, returns {"rail1": {component: array}, "rail2": ..., "total": array}
+# sub-terms are computed at the broadcast shape of the parameters they depend on, e.g. the
+# background cycles once per timing point and shared by both rails
+def energy_model(**overrides) -> dict:
+    for name in overrides:
+        if name not in g_energy_params:
+            raise Exception("Error energy parameter: {}".format(name))
+    p = dict(g_energy_params)
+    p.update(overrides)
+    p = {name: np.asarray(value, dtype=np.float64) for name, value in p.items()}
+
+    tRAS, tRP, tRCD, tCCD = p["tRAS"], p["tRP"], p["tRCD"], p["tCCD"]
+    tRTP, tWL, tWR, BL = p["tRTP"], p["tWL"], p["tWR"], p["BL"]
+    tck = p["tck"]
+    # shared by both rails
+    row_access = tRCD + 64 * tCCD
+    write_tail = row_access + tWL + tWR + BL + 2
+    bg_pre_cycles = (row_access + tRTP) * 2 + write_tail
+    bg_act_cycles = (row_access + 2 * tRTP) * 2 + write_tail + tRP
+    row_clone_cycles = 2 * tRAS + tRP
+
+    results = {}
+    total = 0
+    for rail in g_rails:
+        vdd = p["vdd{}".format(rail)]
+        idd0 = p["idd0{}".format(rail)]
+        idd2n = p["idd2n{}".format(rail)]
+        idd3n = p["idd3n{}".format(rail)]
+        e_act_pre = idd0 * (tRAS + tRP) - idd2n * tRP - idd3n * tRAS * 3
+        rail_result = {
+            "bg_pre": vdd * idd2n * bg_pre_cycles,
+            "bg_act": idd3n * vdd * bg_act_cycles,
+            "read": vdd * (p["idd4r{}".format(rail)] - idd3n) * 8 * tck * 64 * 2,
+            "write": vdd * (p["idd4w{}".format(rail)] - idd3n) * 8 * tck * 64,
+            "act_pre": e_act_pre,
+            "row_clone": e_act_pre * p["rho"] * row_clone_cycles,
+        }
+        rail_total = sum(rail_result[name] for name in g_energy_components)
+        rail_result["total"] = rail_total
+        results["rail{}".format(rail)] = rail_result
+        total = total + rail_total
+    results["total"] = total
+    return results
+
+
+# evaluate the full grid of the given 1-D parameter axes, each axis gets its own dimension
+# so the model only broadcasts sub-terms up to the axes they depend on
+def energy_grid(**axes):
+    names = list(axes.keys())
+    shaped = {}
+    for dim, name in enumerate(names):
+        values = np.asarray(axes[name], dtype=np.float64).ravel()
+        shape = [1] * len(names)
+        shape[dim] = values.size
+        shaped[name] = values.reshape(shape)
+    return names, energy_model(**shaped)
+
+
+# flatten a grid to columns: axes, per rail components and totals
+def energy_table(axes: dict, results: dict):
+    names = list(axes.keys())
+    shape = tuple(np.size(axes[name]) for name in names)
+    columns = {}
+    grids = np.meshgrid(*[np.ravel(axes[name]) for name in names], indexing="ij")
+    for name, grid in zip(names, grids):
+        columns[name] = grid.ravel()
+    for rail in g_rails:
+        rail_result = results["rail{}".format(rail)]
+        for component in g_energy_components + ["total"]:
+            columns["rail{}_{}".format(rail, component)] = np.broadcast_to(
+                rail_result[component], shape
+            ).ravel()
+    columns["total"] = np.broadcast_to(results["total"], shape).ravel()
+    return columns
+
+
+def save_energy_csv(file_path: str, axes: dict, results: dict):
+    columns = energy_table(axes, results)
+    np.savetxt(
+        file_path,
+        np.column_stack(list(columns.values())),
+        delimiter=",",
+        header=",".join(columns.keys()),
+        comments="",
     )
-    total_energy = []
-    for i in range(2):
-        e_bg_pre = vdd[i] * idd2n[i] * bg_pre_cycles
-        e_bg_act = idd3n[i] * vdd[i] * bg_act_cycles
-        e_read = (vdd[i] * (idd4r[i] - idd3n[i])) * 8 * tck * 64 * 2
-        e_write = (vdd[i] * (idd4w[i] - idd3n[i])) * 8 * tck * 64
-        e_act_pre = idd0[i] * (tRAS + tRP) - idd2n[i] * tRP - idd3n[i] * tRAS * 3
-        e_row_clone = e_act_pre * rho * (2 * tRAS + tRP)
-        total_energy.append((
-            e_bg_pre + e_bg_act + e_read + e_write + e_act_pre + e_row_clone
-        )) 
-    print("{},{}".format(total_energy[0],total_energy[1]))
-
-energy()
\ No newline at end of file
+
+
+def energy():
+    results = energy_model()
+    print("{},{}".format(results["rail1"]["total"], results["rail2"]["total"]))
+
+
+if __name__ == "__main__":
+    energy()
+    # axes = {"tRAS": np.linspace(30, 80, 100), "rho": np.linspace(1, 2, 100)}
+    # _, results = energy_grid(**axes)
+    # save_energy_csv("output/energy_grid.csv", axes, results)
@@ -0,0 +1,151 @@
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+
+"""
+Opt-in instrumentation for the converters. Pass a ConvertStats as `stats` to
+convert_to_cacheline / bulk_convert_to_cacheline / sharded_convert_to_cacheline and wrap
+the run with `with stats:`. When stats is None the converters only pay one `is None` check
+per window and per parsed line.
+    @ counters: lines parsed, windows handled, copy windows, normal mode rows, rowclones,
+      error rowclones, cache lines emitted, bytes written (only known with a TraceSink)
+    @ stage timers: handle (CMD4Window logic + expansion), write (sink flushes), parse is
+      the remaining wall time of the `with stats:` block
+    @ optional cProfile and tracemalloc capture
+"""
+
+# how many handled windows between two progress time checks
+g_progress_check_windows = 4096
+
+
+class ConvertStats:
+    def __init__(
+        self,
+        progress_interval: float = 0,
+        profile: bool = False,
+        trace_memory: bool = False,
+        profile_top: int = 20,
+        out=sys.stderr,
+    ):
+        self.lines_parsed = 0
+        self.windows_handled = 0
+        self.copy_windows = 0
+        self.normal_rows = 0
+        self.row_clones = 0
+        self.error_row_clones = 0
+        self.cache_lines = 0
+        self.bytes_written = 0
+        self.handle_time = 0.0
+        self.write_time = 0.0
+        self.total_time = 0.0
+        # seconds between two progress lines, 0 disables progress output
+        self.progress_interval = progress_interval
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profile_top = profile_top
+        self.out = out
+        self.profiler = None
+        self.profile_report = ""
+        self.memory_peak = 0
+        self.memory_top = []
+        self.start_time = 0.0
+        self.last_report = 0.0
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.last_report = self.start_time
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def finish(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats(
+                "cumulative"
+            ).print_stats(self.profile_top)
+            self.profile_report = stream.getvalue()
+            self.profiler = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            _, self.memory_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.memory_top = [
+                str(stat) for stat in snapshot.statistics("lineno")[: self.profile_top]
+            ]
+        self.total_time += time.perf_counter() - self.start_time
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish()
+        return False
+
+    # called by CMD4Window after each handled window
+    def record_window(self, copy_window: bool, rows: int, cache_lines: int):
+        self.windows_handled += 1
+        if copy_window:
+            self.copy_windows += 1
+        else:
+            self.normal_rows += rows
+        self.cache_lines += cache_lines
+        if (
+            self.progress_interval > 0
+            and self.windows_handled % g_progress_check_windows == 0
+        ):
+            now = time.perf_counter()
+            if now - self.last_report >= self.progress_interval:
+                self.last_report = now
+                self.report_progress(now)
+
+    def report_progress(self, now: float):
+        elapsed = now - self.start_time
+        print(
+            "[progress] {:.1f}s lines {} windows {} rowclones {} cache lines {} ({:.0f} lines/s)".format(
+                elapsed,
+                self.lines_parsed,
+                self.windows_handled,
+                self.row_clones,
+                self.cache_lines,
+                self.lines_parsed / elapsed if elapsed > 0 else 0,
+            ),
+            file=self.out,
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "lines_parsed": self.lines_parsed,
+            "windows_handled": self.windows_handled,
+            "copy_windows": self.copy_windows,
+            "normal_rows": self.normal_rows,
+            "row_clones": self.row_clones,
+            "error_row_clones": self.error_row_clones,
+            "cache_lines": self.cache_lines,
+            "bytes_written": self.bytes_written,
+            "time": {
+                "total": self.total_time,
+                # sink flushes happen inside handle, report them apart
+                "handle": max(self.handle_time - self.write_time, 0),
+                "write": self.write_time,
+                "parse": max(self.total_time - self.handle_time, 0),
+            },
+            "memory_peak": self.memory_peak,
+            "memory_top": self.memory_top,
+            "profile": self.profile_report,
+        }
+
+    def to_json(self, file_path: str = None) -> str:
+        text = json.dumps(self.to_dict(), indent=2)
+        if file_path is not None:
+            with open(file_path, "w") as file:
+                file.write(text)
+        return text
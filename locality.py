@@ -0,0 +1,177 @@
+import heapq
+import json
+import sys
+
+import address_helper as ah
+
+"""
+Row reuse distance and locality of a trace, to judge whether remapping (map vs unmap cases,
+bucket_mapper) pays off:
+    @ reuse distance = distinct rows (or subarrays) touched between two accesses of the same
+      one, computed in O(log n) per access with a Fenwick tree over last-access positions
+    @ log2 histograms at row and subarray level, first touches counted as cold
+    @ working set size (distinct rows) of every epoch of `epoch` accesses
+    @ top hot rows
+Works on raw row traces and on converted cache line traces; for the latter the 64 requests of
+an expanded row are one access when collapse_runs is set, also in alternant mode where the
+read and write rows of a copy interleave line by line. A rowclone touches src then dst.
+"""
+
+g_row_shift = ah.g_assemble_levels_bits[4]
+g_fenwick_initial_size = 1 << 20
+
+
+class ReuseDistance:
+    def __init__(self, capacity: int = g_fenwick_initial_size):
+        self.capacity = capacity
+        self.tree = [0] * (capacity + 1)
+        self.last = {}
+        self.time = 0
+        self.cold = 0
+        # bucket b holds distances in [2^(b-1), 2^b), bucket 0 holds distance 0
+        self.histogram = []
+
+    def add(self, position: int, delta: int):
+        position += 1
+        while position <= self.capacity:
+            self.tree[position] += delta
+            position += position & -position
+
+    def prefix(self, position: int) -> int:
+        # sum over [0, position)
+        total = 0
+        while position > 0:
+            total += self.tree[position]
+            position -= position & -position
+        return total
+
+    def compact(self):
+        # keep only the live last-access positions, renumbered in order
+        order = sorted(self.last.items(), key=lambda item: item[1])
+        self.capacity = max(self.capacity, 2 * len(order) + 1)
+        self.tree = [0] * (self.capacity + 1)
+        self.last = {}
+        for position, (key, _) in enumerate(order):
+            self.last[key] = position
+            self.add(position, 1)
+        self.time = len(order)
+
+    def access(self, key) -> int:
+        if self.time >= self.capacity:
+            self.compact()
+        previous = self.last.get(key)
+        if previous is None:
+            self.cold += 1
+            distance = -1
+        else:
+            # live markers after the previous access are the distinct keys in between,
+            # every key has exactly one live marker so all markers sum to len(last)
+            distance = len(self.last) - self.prefix(previous + 1)
+            self.add(previous, -1)
+            bucket = distance.bit_length()
+            if bucket >= len(self.histogram):
+                self.histogram.extend([0] * (bucket + 1 - len(self.histogram)))
+            self.histogram[bucket] += 1
+        self.add(self.time, 1)
+        self.last[key] = self.time
+        self.time += 1
+        return distance
+
+    def report(self) -> dict:
+        buckets = {}
+        for bucket, count in enumerate(self.histogram):
+            if bucket == 0:
+                label = "0"
+            else:
+                label = "{}-{}".format(1 << (bucket - 1), (1 << bucket) - 1)
+            buckets[label] = count
+        return {"cold": self.cold, "distinct": len(self.last), "histogram": buckets}
+
+
+class LocalityAnalyzer:
+    def __init__(self, epoch: int = 100000, collapse_runs: bool = True):
+        self.rows = ReuseDistance()
+        self.subarrays = ReuseDistance()
+        self.hits = {}
+        self.epoch = epoch
+        self.epoch_rows = set()
+        self.epoch_accesses = 0
+        self.working_sets = []
+        self.collapse_runs = collapse_runs
+        # last cache line of each op, an expanded row walks its cache lines in order
+        self.last_line = {}
+        self.accesses = 0
+
+    # op is "RD"/"WR" for cache line requests, None for rowclone rows that never collapse
+    def access(self, addr: int, op: str = None):
+        addr = ah.mask_address(addr)
+        row = addr >> g_row_shift
+        if self.collapse_runs and op is not None:
+            previous = self.last_line.get(op)
+            self.last_line[op] = addr
+            # next cache line of the same row and op: same expanded row group
+            if (
+                previous is not None
+                and addr - previous == 1 << ah.g_tx_offset
+                and previous >> g_row_shift == row
+            ):
+                return
+        self.accesses += 1
+        self.rows.access(row)
+        self.subarrays.access(addr >> ah.g_subarray_offset)
+        self.hits[row] = self.hits.get(row, 0) + 1
+        self.epoch_rows.add(row)
+        self.epoch_accesses += 1
+        if self.epoch_accesses == self.epoch:
+            self.working_sets.append(len(self.epoch_rows))
+            self.epoch_rows = set()
+            self.epoch_accesses = 0
+
+    def feed(self, line: str):
+        items = line.split()
+        if len(items) == 2:
+            self.access(int(items[1]), "RD")
+        elif len(items) == 3:
+            if items[1] == "-1" or items[1] == "-2":
+                self.access(int(items[2]), "WR")
+            else:
+                # rowclone
+                self.access(int(items[1]))
+                self.access(int(items[2]))
+        # a single field line is a bubble count
+
+    def report(self, top: int = 20) -> dict:
+        working_sets = list(self.working_sets)
+        if self.epoch_accesses:
+            working_sets.append(len(self.epoch_rows))
+        hot = heapq.nlargest(top, self.hits.items(), key=lambda item: item[1])
+        return {
+            "accesses": self.accesses,
+            "row": self.rows.report(),
+            "subarray": self.subarrays.report(),
+            "working_set": working_sets,
+            "hot_rows": [
+                {
+                    "bank": ah.address_to_byte_level(row << g_row_shift)[2],
+                    "row": ah.address_to_byte_level(row << g_row_shift)[3],
+                    "accesses": count,
+                }
+                for row, count in hot
+            ],
+        }
+
+
+def analyze_trace(
+    file_path: str, epoch: int = 100000, top: int = 20, collapse_runs: bool = True
+):
+    analyzer = LocalityAnalyzer(epoch, collapse_runs)
+    with open(file_path, "r") as file:
+        for line in file:
+            analyzer.feed(line)
+    return analyzer.report(top)
+
+
+if __name__ == "__main__":
+    # python locality.py <trace> [epoch]
+    epoch = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    print(json.dumps(analyze_trace(sys.argv[1], epoch), indent=2))
@@ -0,0 +1,195 @@
+from array import array
+
+import address_helper as ah
+
+"""
+Row level intermediate representation of a converted trace. The 64-way cache line expansion
+of a row is fully determined by (op, row base address, bubble, mode), so the windows can
+record one IR entry per row instead of 64 strings:
+    @ READ / WRITE / DMA_WRITE: one row, 64 cache line requests, bubble on the first one
+    @ PAIR: a read row and a write row split in alternative (interleaved) mode, 128 requests
+    @ RC: one rowclone command
+Counts, per bank totals, byte sizes and shard cuts are derived analytically, the cache line
+strings are only built in expand()/write_to(), i.e. inside the final trace writer.
+"""
+
+
+class IROp:
+    READ = 0
+    WRITE = 1
+    DMA_WRITE = 2
+    PAIR = 3
+    RC = 4
+
+
+g_cache_lines_per_row = 64
+g_row_mask = ~((1 << ah.g_assemble_levels_bits[4]) - 1)
+g_bank_shift = ah.g_assemble_levels_bits[4] + ah.g_assemble_levels_bits[3]
+# cache lines of each op
+g_op_requests = [
+    g_cache_lines_per_row,
+    g_cache_lines_per_row,
+    g_cache_lines_per_row,
+    2 * g_cache_lines_per_row,
+    1,
+]
+
+
+# total characters of str(base + cl * step) for cl in [0, count)
+def digits_sum(base: int, step: int, count: int) -> int:
+    total = 0
+    start = 0
+    while start < count:
+        digits = len(str(base + start * step))
+        # first index that reaches the next power of 10
+        bound = 10**digits
+        end = min(count, -(-(bound - base) // step))
+        total += (end - start) * digits
+        start = end
+    return total
+
+
+class RowIR:
+    def __init__(self):
+        # parallel arrays, about 25 bytes per row instead of 64 strings
+        self.ops = array("b")
+        self.addr_a = array("q")
+        self.addr_b = array("q")
+        self.bubbles = array("q")
+        self.op_count = [0] * len(g_op_requests)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def append(self, op: int, addr_a: int, addr_b: int, bubble: int):
+        self.ops.append(op)
+        self.addr_a.append(addr_a)
+        self.addr_b.append(addr_b)
+        self.bubbles.append(bubble)
+        self.op_count[op] += 1
+
+    # bulk append of parallel columns, e.g. the entries of window_kernel
+    def extend(self, ops: list, addr_a: list, addr_b: list, bubbles: list):
+        self.ops.extend(ops)
+        self.addr_a.extend(addr_a)
+        self.addr_b.extend(addr_b)
+        self.bubbles.extend(bubbles)
+        for op in range(len(self.op_count)):
+            self.op_count[op] += ops.count(op)
+
+    def add_row(self, op: int, addr: int, bubble: int):
+        self.append(op, addr & g_row_mask, -1, bubble)
+
+    def add_pair(self, read_addr: int, write_addr: int):
+        self.append(IROp.PAIR, read_addr & g_row_mask, write_addr & g_row_mask, 0)
+
+    def add_row_clone(self, src: int, dst: int):
+        self.append(IROp.RC, src, dst, 0)
+
+    def cache_lines(self) -> int:
+        return sum(count * lines for count, lines in zip(self.op_count, g_op_requests))
+
+    def row_clone_count(self) -> int:
+        return self.op_count[IROp.RC]
+
+    def entry_requests(self, index: int) -> int:
+        return g_op_requests[self.ops[index]]
+
+    def entry_bytes(self, index: int) -> int:
+        op = self.ops[index]
+        a = self.addr_a[index]
+        step = 1 << ah.g_tx_offset
+        if op == IROp.RC:
+            return len("0 {} {}\n".format(a, self.addr_b[index]))
+        if op == IROp.PAIR:
+            # "0 rd\n" and "0 -1 wr\n" for each cache line
+            return (
+                digits_sum(a, step, g_cache_lines_per_row)
+                + digits_sum(self.addr_b[index], step, g_cache_lines_per_row)
+                + g_cache_lines_per_row * (3 + 6)
+            )
+        # first line carries the bubble, the others "0"
+        prefix = len(str(self.bubbles[index])) + 1 + (g_cache_lines_per_row - 1) * 2
+        if op != IROp.READ:
+            prefix += g_cache_lines_per_row * 3
+        return (
+            prefix + digits_sum(a, step, g_cache_lines_per_row) + g_cache_lines_per_row
+        )
+
+    def total_bytes(self, start: int = 0, end: int = None) -> int:
+        end = len(self.ops) if end is None else end
+        return sum(self.entry_bytes(index) for index in range(start, end))
+
+    # cache line requests (rowclones counted once) per bank
+    def bank_requests(self) -> list[int]:
+        totals = [0] * ah.g_bank_num
+        for op, a, b in zip(self.ops, self.addr_a, self.addr_b):
+            bank = (a >> g_bank_shift) & (ah.g_bank_num - 1)
+            if op == IROp.RC:
+                totals[bank] += 1
+            elif op == IROp.PAIR:
+                totals[bank] += g_cache_lines_per_row
+                totals[
+                    (b >> g_bank_shift) & (ah.g_bank_num - 1)
+                ] += g_cache_lines_per_row
+            else:
+                totals[bank] += g_cache_lines_per_row
+        return totals
+
+    # [start, end) entry ranges whose expansion reaches the target size
+    def shard_ranges(self, target_requests: int = None, target_bytes: int = None):
+        if target_requests is None and target_bytes is None:
+            raise Exception("Error: sharding needs target requests or target bytes")
+        ranges = []
+        start = 0
+        requests = 0
+        size = 0
+        for index in range(len(self.ops)):
+            requests += g_op_requests[self.ops[index]]
+            if target_bytes is not None:
+                size += self.entry_bytes(index)
+            if (target_requests is not None and requests >= target_requests) or (
+                target_bytes is not None and size >= target_bytes
+            ):
+                ranges.append((start, index + 1, requests, size))
+                start = index + 1
+                requests = 0
+                size = 0
+        if start < len(self.ops):
+            ranges.append((start, len(self.ops), requests, size))
+        return ranges
+
+    def expand_entry(self, index: int) -> list[str]:
+        op = self.ops[index]
+        a = self.addr_a[index]
+        tx_offset = ah.g_tx_offset
+        if op == IROp.RC:
+            return ["0 {} {}".format(a, self.addr_b[index])]
+        if op == IROp.PAIR:
+            b = self.addr_b[index]
+            lines = []
+            for cl in range(g_cache_lines_per_row):
+                lines.append("0 {}".format(a + (cl << tx_offset)))
+                lines.append("0 -1 {}".format(b + (cl << tx_offset)))
+            return lines
+        if op == IROp.READ:
+            pattern = "{} {}"
+        elif op == IROp.WRITE:
+            pattern = "{} -1 {}"
+        else:
+            pattern = "{} -2 {}"
+        lines = [pattern.format(self.bubbles[index], a)]
+        for cl in range(1, g_cache_lines_per_row):
+            lines.append(pattern.format(0, a + (cl << tx_offset)))
+        return lines
+
+    def expand(self, start: int = 0, end: int = None):
+        end = len(self.ops) if end is None else end
+        for index in range(start, end):
+            yield from self.expand_entry(index)
+
+    # the final trace writer, sink is a TraceSink/ShardedTraceSink/ReorderStage
+    def write_to(self, sink, start: int = 0, end: int = None):
+        end = len(self.ops) if end is None else end
+        for index in range(start, end):
+            sink.extend(self.expand_entry(index))
@@ -0,0 +1,279 @@
+import json
+import os
+
+import numpy as np
+
+import address_helper as ah
+import converter as cv
+from instrument import ConvertStats
+from row_ir import RowIR
+from trace_sink import TraceSink
+
+"""
+Representative sampling in the spirit of SimPoint, to cut Ramulator2 time on long traces.
+    @ split the row request stream into intervals of `interval_rows` rows
+    @ convert every interval into row level IR and build a feature vector: bank histogram,
+      subarray histogram, copy window / rowclone rates, bubbles and cache lines per row
+    @ cluster the vectors with k-means, the interval closest to each centroid represents
+      its cluster and is weighted by the rows of the cluster
+    @ write the representative slices and weights.json, and check the weighted estimate of
+      the full trace statistics against the exact counts
+Input lines are in the 4-line layout of inputs/extend4 (bulk_convert_to_cacheline input),
+converted by CMD4Window, so intervals are cut at multiples of its 4-row copy window.
+"""
+
+# subarray histogram bins in a bank
+g_subarray_bins = 8
+g_row_shift = ah.g_assemble_levels_bits[4]
+g_bank_shift = g_row_shift + ah.g_assemble_levels_bits[3]
+# rows of one copy window in the extend4 layout, intervals never split one
+g_copy_window_rows = 4
+
+
+def load_trace_lines(file_path: str) -> list[str]:
+    with open(file_path, "r") as file:
+        return [line for line in file.read().split("\n") if line]
+
+
+def convert_interval(
+    lines: list,
+    start: int,
+    end: int,
+    replace_with_rowclone: bool,
+):
+    stats = ConvertStats()
+    ir = RowIR()
+    cv.bulk_convert_to_cacheline(
+        lines,
+        start,
+        end - start,
+        end - start,
+        False,
+        replace_with_rowclone,
+        stats=stats,
+        ir=ir,
+    )
+    return stats, ir
+
+
+# exact counters of one conversion over the whole trace, the reference of validate_sample
+def full_trace_counters(
+    trace_file: str,
+    lines: list,
+    replace_with_rowclone: bool,
+):
+    stats = ConvertStats()
+    ir = RowIR()
+    cv.convert_to_cacheline(
+        trace_file,
+        len(lines),
+        False,
+        replace_with_rowclone,
+        stats=stats,
+        ir=ir,
+    )
+    return interval_counters(lines, 0, len(lines), stats, ir)
+
+
+def interval_counters(lines: list, start: int, end: int, stats, ir: RowIR):
+    fields = [lines[idx].split() for idx in range(start, end)]
+    addrs = np.array(
+        [int(items[1]) if len(items) == 2 else int(items[2]) for items in fields],
+        dtype=np.int64,
+    )
+    addrs &= (1 << ah.g_bits_matters_mask) - 1
+    rows = (addrs >> g_row_shift) & ((1 << ah.g_assemble_levels_bits[3]) - 1)
+    banks = np.bincount(
+        (addrs >> g_bank_shift) & (ah.g_bank_num - 1), minlength=ah.g_bank_num
+    )
+    subarrays = np.bincount(
+        np.minimum(
+            rows // ah.g_subarray_size * g_subarray_bins // ah.g_subarray_num,
+            g_subarray_bins - 1,
+        ),
+        minlength=g_subarray_bins,
+    )
+    return {
+        "rows": end - start,
+        "copy_windows": stats.copy_windows,
+        "row_clones": ir.row_clone_count(),
+        "bubbles": sum(int(items[0]) for items in fields),
+        "cache_lines": ir.cache_lines(),
+        "bank_rows": banks,
+        "subarray_rows": subarrays,
+        "bank_requests": np.array(ir.bank_requests()),
+    }
+
+
+def feature_vector(counters: dict) -> np.ndarray:
+    rows = max(counters["rows"], 1)
+    return np.concatenate(
+        [
+            counters["bank_rows"] / rows,
+            counters["subarray_rows"] / rows,
+            [
+                counters["copy_windows"] / rows,
+                counters["row_clones"] / rows,
+                counters["bubbles"] / rows,
+                counters["cache_lines"] / rows / 64,
+            ],
+        ]
+    )
+
+
+# plain Lloyd iterations with k-means++ seeding
+def kmeans(points: np.ndarray, k: int, iterations: int = 100, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    n = points.shape[0]
+    k = min(k, n)
+    centroids = [points[rng.integers(n)]]
+    for _ in range(1, k):
+        dist = np.min(
+            ((points[:, None, :] - np.array(centroids)[None, :, :]) ** 2).sum(-1),
+            axis=1,
+        )
+        if dist.sum() == 0:
+            centroids.append(points[rng.integers(n)])
+        else:
+            centroids.append(points[rng.choice(n, p=dist / dist.sum())])
+    centroids = np.array(centroids)
+    labels = np.zeros(n, dtype=np.int64)
+    for iteration in range(iterations):
+        dist = ((points[:, None, :] - centroids[None, :, :]) ** 2).sum(-1)
+        new_labels = dist.argmin(axis=1)
+        if iteration > 0 and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for cluster in range(k):
+            members = points[labels == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+    return labels, centroids
+
+
+def sample_trace(
+    trace_file: str,
+    output_dir: str,
+    interval_rows: int = 10000,
+    k: int = 8,
+    replace_with_rowclone: bool = True,
+    seed: int = 0,
+):
+    if interval_rows % g_copy_window_rows != 0:
+        raise Exception(
+            "Error: interval_rows {} would split copy windows, use a multiple of {}".format(
+                interval_rows, g_copy_window_rows
+            )
+        )
+    lines = load_trace_lines(trace_file)
+    bounds = [
+        (start, min(start + interval_rows, len(lines)))
+        for start in range(0, len(lines), interval_rows)
+    ]
+    counters = []
+    irs = []
+    for start, end in bounds:
+        stats, ir = convert_interval(lines, start, end, replace_with_rowclone)
+        counters.append(interval_counters(lines, start, end, stats, ir))
+        irs.append(ir)
+    features = np.array([feature_vector(c) for c in counters])
+    # standardize so rates and histograms weigh alike
+    spread = features.std(axis=0)
+    spread[spread == 0] = 1
+    points = (features - features.mean(axis=0)) / spread
+    labels, centroids = kmeans(points, k, seed=seed)
+
+    slices = []
+    representatives = {}
+    for cluster in range(centroids.shape[0]):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+        dist = ((points[members] - centroids[cluster]) ** 2).sum(-1)
+        rep = int(members[dist.argmin()])
+        cluster_rows = sum(counters[idx]["rows"] for idx in members)
+        representatives[rep] = cluster_rows
+        slice_file = "sample{}.trace".format(len(slices))
+        with TraceSink(os.path.join(output_dir, slice_file)) as sink:
+            irs[rep].write_to(sink)
+        slices.append(
+            {
+                "file": slice_file,
+                "interval": rep,
+                "input_start": bounds[rep][0],
+                "input_end": bounds[rep][1],
+                "cluster_intervals": len(members),
+                "cluster_rows": cluster_rows,
+                "weight": cluster_rows / len(lines),
+            }
+        )
+    with open(os.path.join(output_dir, "weights.json"), "w") as file:
+        json.dump(
+            {
+                "source": trace_file,
+                "interval_rows": interval_rows,
+                "intervals": len(bounds),
+                "k": k,
+                "slices": slices,
+            },
+            file,
+            indent=2,
+        )
+    reference = full_trace_counters(trace_file, lines, replace_with_rowclone)
+    validation = validate_sample(counters, representatives, reference)
+    validation["sampled_rows"] = sum(counters[rep]["rows"] for rep in representatives)
+    validation["total_rows"] = len(lines)
+    return slices, validation
+
+
+# weighted estimate of the whole trace against the exact counters of one full-trace
+# conversion, see full_trace_counters
+def validate_sample(counters: list, representatives: dict, reference: dict) -> dict:
+    metrics = ["cache_lines", "row_clones", "copy_windows", "bubbles", "bank_requests"]
+    report = {}
+    for metric in metrics:
+        exact = np.asarray(reference[metric], dtype=np.float64)
+        estimate = sum(
+            np.asarray(counters[rep][metric], dtype=np.float64)
+            * rows
+            / counters[rep]["rows"]
+            for rep, rows in representatives.items()
+        )
+        error = np.abs(estimate - exact) / np.maximum(exact, 1)
+        report[metric] = {
+            "exact": exact.tolist(),
+            "estimate": estimate.tolist(),
+            "relative_error": error.tolist(),
+        }
+    return report
+
+
+def print_validation(validation: dict):
+    print(
+        "sampled {} of {} rows".format(
+            validation["sampled_rows"], validation["total_rows"]
+        )
+    )
+    for metric, values in validation.items():
+        if not isinstance(values, dict):
+            continue
+        error = np.max(values["relative_error"])
+        print(
+            "{}: exact {} estimate {} max relative error {:.2%}".format(
+                metric,
+                np.round(values["exact"]).astype(np.int64).tolist(),
+                np.round(values["estimate"]).astype(np.int64).tolist(),
+                error,
+            )
+        )
+
+
+if __name__ == "__main__":
+    for mode in ["unmap", "map"]:
+        for case in range(6):
+            trace_file = "inputs/extend4/{}4_case{}.trace".format(mode, case)
+            _, validation = sample_trace(
+                trace_file, "output/sample/{}4_case{}/".format(mode, case)
+            )
+            print(trace_file)
+            print_validation(validation)
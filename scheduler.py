@@ -0,0 +1,246 @@
+from collections import deque
+
+import address_helper as ah
+from trace_sink import TraceSink
+
+"""
+Optional scheduling stage after conversion. An expanded row comes out as 64 back-to-back
+cache line requests to one bank/row; a host with a request queue could interleave them
+across banks. ReorderStage sits between a window (CMD4Window) and its sink,
+buffers up to `window` cache line requests and issues them by policy:
+    @ preserve: converter order, a reference point
+    @ round_robin: next bank that has a queued request, oldest request of that bank first
+    @ frfcfs: row hit in any bank first (oldest hit), otherwise the oldest request; a request
+      older than `window` arrivals is issued first so row hits cannot starve it
+Rules kept by every policy:
+    @ requests to the same bank/row keep their relative order (read/write ordering)
+    @ a rowclone command stays in place, everything before it is issued first
+    @ a request with a bubble count > 0 starts a new group, the host was idle before it
+"""
+
+
+class SchedPolicy:
+    PRESERVE = "preserve"
+    ROUND_ROBIN = "round_robin"
+    FRFCFS = "frfcfs"
+
+
+g_row_shift = ah.g_assemble_levels_bits[4]
+g_bank_shift = g_row_shift + ah.g_assemble_levels_bits[3]
+g_row_mask = (1 << ah.g_assemble_levels_bits[3]) - 1
+
+
+# bank, row of a cache line request, None for a rowclone command
+def decode_bank_row(line: str):
+    items = line.split()
+    if len(items) == 2:
+        addr = int(items[1])
+    elif items[1] == "-1" or items[1] == "-2":
+        addr = int(items[2])
+    else:
+        return None
+    addr = ah.mask_address(addr)
+    return (addr >> g_bank_shift) & (ah.g_bank_num - 1), (
+        addr >> g_row_shift
+    ) & g_row_mask
+
+
+class ReorderStage:
+    def __init__(self, sink, policy: str = SchedPolicy.FRFCFS, window: int = 256):
+        if policy not in (
+            SchedPolicy.PRESERVE,
+            SchedPolicy.ROUND_ROBIN,
+            SchedPolicy.FRFCFS,
+        ):
+            raise Exception("Error schedule policy: {}".format(policy))
+        self.sink = sink
+        self.policy = policy
+        self.window = window
+        # bank -> row -> queued (seq, line), oldest first
+        self.banks: list[dict] = [{} for _ in range(ah.g_bank_num)]
+        self.queued = 0
+        self.seq = 0
+        self.next_bank = 0
+        self.open_row = [-1] * ah.g_bank_num
+        self.lines_in = 0
+
+    def attach_stats(self, stats):
+        self.sink.attach_stats(stats)
+
+    def total_lines(self) -> int:
+        return self.lines_in
+
+    def write(self, line: str):
+        self.lines_in += 1
+        bank_row = decode_bank_row(line)
+        if bank_row is None:
+            # rowclone stays in place
+            self.drain()
+            self.sink.write(line)
+            return
+        if line[0] != "0" and self.queued:
+            # bubble count > 0, requests after it were not visible before it
+            self.drain()
+        if self.policy == SchedPolicy.PRESERVE:
+            self.sink.write(line)
+            return
+        bank, row = bank_row
+        rows = self.banks[bank]
+        queue = rows.get(row)
+        if queue is None:
+            queue = rows[row] = deque()
+        queue.append((self.seq, line))
+        self.seq += 1
+        self.queued += 1
+        if self.queued >= self.window:
+            self.issue()
+
+    def extend(self, lines: list):
+        for line in lines:
+            self.write(line)
+
+    # oldest queued row of a bank
+    def oldest_row(self, bank: int):
+        best_row = None
+        best_seq = -1
+        for row, queue in self.banks[bank].items():
+            if best_row is None or queue[0][0] < best_seq:
+                best_row = row
+                best_seq = queue[0][0]
+        return best_row, best_seq
+
+    def pick(self):
+        if self.policy == SchedPolicy.ROUND_ROBIN:
+            for step in range(ah.g_bank_num):
+                bank = (self.next_bank + step) % ah.g_bank_num
+                if self.banks[bank]:
+                    self.next_bank = (bank + 1) % ah.g_bank_num
+                    return bank, self.oldest_row(bank)[0]
+            return None
+        # frfcfs, oldest row hit first, then oldest request
+        hit = None
+        hit_seq = -1
+        oldest = None
+        oldest_seq = -1
+        for bank in range(ah.g_bank_num):
+            rows = self.banks[bank]
+            if not rows:
+                continue
+            queue = rows.get(self.open_row[bank])
+            if queue is not None and (hit is None or queue[0][0] < hit_seq):
+                hit = (bank, self.open_row[bank])
+                hit_seq = queue[0][0]
+            row, seq = self.oldest_row(bank)
+            if oldest is None or seq < oldest_seq:
+                oldest = (bank, row)
+                oldest_seq = seq
+        if hit is None or self.seq - oldest_seq > self.window:
+            # starvation cap, like the age threshold of FR-FCFS controllers
+            return oldest
+        return hit
+
+    def issue(self):
+        picked = self.pick()
+        if picked is None:
+            return
+        bank, row = picked
+        rows = self.banks[bank]
+        queue = rows[row]
+        _, line = queue.popleft()
+        if not queue:
+            del rows[row]
+        self.open_row[bank] = row
+        self.queued -= 1
+        self.sink.write(line)
+
+    def drain(self):
+        while self.queued:
+            self.issue()
+
+    def close(self):
+        self.drain()
+        self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+# row hit rate with one open row per bank, and average distinct banks in each group of
+# `group` consecutive requests, a rough view of the bank parallelism a trace exposes
+class ParallelismCounter:
+    def __init__(self, group: int = 8):
+        self.group = group
+        self.requests = 0
+        self.row_hits = 0
+        self.row_clones = 0
+        self.open_row = [-1] * ah.g_bank_num
+        self.group_banks = set()
+        self.group_size = 0
+        self.groups = 0
+        self.bank_sum = 0
+
+    def write(self, line: str):
+        bank_row = decode_bank_row(line)
+        if bank_row is None:
+            self.row_clones += 1
+            return
+        bank, row = bank_row
+        self.requests += 1
+        if self.open_row[bank] == row:
+            self.row_hits += 1
+        self.open_row[bank] = row
+        self.group_banks.add(bank)
+        self.group_size += 1
+        if self.group_size == self.group:
+            self.groups += 1
+            self.bank_sum += len(self.group_banks)
+            self.group_banks.clear()
+            self.group_size = 0
+
+    def extend(self, lines: list):
+        for line in lines:
+            self.write(line)
+
+    def attach_stats(self, stats):
+        pass
+
+    def total_lines(self) -> int:
+        return self.requests + self.row_clones
+
+    def close(self):
+        pass
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.requests,
+            "row_clones": self.row_clones,
+            "row_hit_rate": self.row_hits / self.requests if self.requests else 0,
+            "banks_per_group": self.bank_sum / self.groups if self.groups else 0,
+        }
+
+
+def reorder_trace_file(
+    input_path: str, output_path: str, policy: str, window: int = 256
+):
+    with open(input_path, "r") as file:
+        with ReorderStage(TraceSink(output_path), policy, window) as stage:
+            for line in file:
+                stage.write(line.rstrip("\n"))
+
+
+# compare policies on a converted cache line trace
+def compare_sched_policies(trace_file: str, window: int = 256, group: int = 8):
+    results = {}
+    for policy in [SchedPolicy.PRESERVE, SchedPolicy.ROUND_ROBIN, SchedPolicy.FRFCFS]:
+        counter = ParallelismCounter(group)
+        with open(trace_file, "r") as file:
+            with ReorderStage(counter, policy, window) as stage:
+                for line in file:
+                    stage.write(line.rstrip("\n"))
+        results[policy] = counter.summary()
+        print("{}: {}".format(policy, results[policy]))
+    return results
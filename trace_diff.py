@@ -0,0 +1,211 @@
+import concurrent.futures
+import hashlib
+import os
+import sys
+
+import address_helper as ah
+
+"""
+Fast equivalence check of two converted traces, e.g. an optimized/parallel conversion path
+against the reference convert_to_cacheline/bulk_convert_to_cacheline output:
+    @ both files are cut at line boundaries near every `chunk_size` bytes, chunks are hashed
+      in parallel, identical prefixes give identical chunks
+    @ inside the first differing chunk we binary search the first differing byte
+    @ report the line number, both lines decoded to bank/row/column and counter deltas
+diff_row_ir does the same on two RowIR objects without expanding them.
+"""
+
+g_diff_chunk_size = 64 << 20
+
+
+# chunk start offsets, aligned to the line after each multiple of chunk_size
+def chunk_offsets(file_path: str, chunk_size: int) -> list[int]:
+    size = os.path.getsize(file_path)
+    offsets = [0]
+    with open(file_path, "rb") as file:
+        position = chunk_size
+        while position < size:
+            file.seek(position - 1)
+            file.readline()
+            aligned = file.tell()
+            if aligned >= size:
+                break
+            if aligned > offsets[-1]:
+                offsets.append(aligned)
+            position = aligned + chunk_size
+    offsets.append(size)
+    return offsets
+
+
+# counters of a block of whole trace lines, without splitting it into lines
+def count_block(data: bytes) -> list[int]:
+    lines = data.count(b"\n")
+    three_fields = data.count(b" ") - lines
+    writes = data.count(b" -1 ") + data.count(b" -2 ")
+    return [lines, lines - three_fields, writes, three_fields - writes]
+
+
+def hash_chunk(file_path: str, start: int, end: int):
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+    return hashlib.blake2b(data, digest_size=16).digest(), count_block(data)
+
+
+def submit_chunks(file_path: str, offsets: list[int], executor):
+    return [
+        executor.submit(hash_chunk, file_path, offsets[idx], offsets[idx + 1])
+        for idx in range(len(offsets) - 1)
+    ]
+
+
+def first_diff_byte(data_a: bytes, data_b: bytes) -> int:
+    size = min(len(data_a), len(data_b))
+    lo = 0
+    hi = size
+    # slice compare is a memcmp, so halving costs O(n) in total
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if data_a[lo:mid] == data_b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid
+    if lo < size and data_a[lo] == data_b[lo]:
+        return lo + 1
+    return lo
+
+
+def decode_trace_line(line: str) -> str:
+    items = line.split()
+    if len(items) < 2:
+        return "<empty>"
+    if len(items) == 2:
+        return "[RD] bank-row-column {}".format(
+            ah.address_to_byte_level(int(items[1]))[2:]
+        )
+    if items[1] == "-1" or items[1] == "-2":
+        return "[WR] bank-row-column {}".format(
+            ah.address_to_byte_level(int(items[2]))[2:]
+        )
+    return "[RC] bank-row-column {} to {}".format(
+        ah.address_to_byte_level(int(items[1]))[2:],
+        ah.address_to_byte_level(int(items[2]))[2:],
+    )
+
+
+def read_line_at(file_path: str, offset: int) -> str:
+    with open(file_path, "rb") as file:
+        start = max(offset - 4096, 0)
+        file.seek(start)
+        head = file.read(offset - start)
+        line_start = start + head.rfind(b"\n") + 1
+        file.seek(line_start)
+        return file.readline().decode().rstrip("\n")
+
+
+def diff_traces(
+    path_a: str,
+    path_b: str,
+    chunk_size: int = g_diff_chunk_size,
+    workers: int = None,
+):
+    offsets_a = chunk_offsets(path_a, chunk_size)
+    offsets_b = chunk_offsets(path_b, chunk_size)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # both files are hashed at the same time
+        futures_a = submit_chunks(path_a, offsets_a, executor)
+        futures_b = submit_chunks(path_b, offsets_b, executor)
+        chunks_a = [future.result() for future in futures_a]
+        chunks_b = [future.result() for future in futures_b]
+    totals_a = [sum(column) for column in zip(*[c[1] for c in chunks_a])] or [0] * 4
+    totals_b = [sum(column) for column in zip(*[c[1] for c in chunks_b])] or [0] * 4
+    names = ["lines", "reads", "writes", "row_clones"]
+    result = {
+        "equal": True,
+        "line": None,
+        "line_a": None,
+        "line_b": None,
+        "counters_a": dict(zip(names, totals_a)),
+        "counters_b": dict(zip(names, totals_b)),
+        "deltas": {name: b - a for name, a, b in zip(names, totals_a, totals_b)},
+    }
+    first = None
+    for idx in range(max(len(chunks_a), len(chunks_b))):
+        if idx >= len(chunks_a) or idx >= len(chunks_b):
+            first = idx
+            break
+        if (
+            chunks_a[idx][0] != chunks_b[idx][0]
+            or offsets_a[idx + 1] != offsets_b[idx + 1]
+        ):
+            first = idx
+            break
+    if first is None:
+        return result
+    result["equal"] = False
+    # lines before the differing chunk
+    line = sum(chunk[1][0] for chunk in chunks_a[:first])
+    start = offsets_a[first] if first < len(offsets_a) else offsets_a[-1]
+    end_a = offsets_a[first + 1] if first + 1 < len(offsets_a) else start
+    end_b = offsets_b[first + 1] if first + 1 < len(offsets_b) else start
+    with open(path_a, "rb") as file:
+        file.seek(start)
+        data_a = file.read(end_a - start)
+    with open(path_b, "rb") as file:
+        file.seek(start)
+        data_b = file.read(end_b - start)
+    diff_at = first_diff_byte(data_a, data_b)
+    line += data_a[:diff_at].count(b"\n")
+    result["line"] = line + 1
+    result["line_a"] = read_line_at(path_a, start + diff_at)
+    result["line_b"] = read_line_at(path_b, start + diff_at)
+    return result
+
+
+def print_diff(result: dict):
+    if result["equal"]:
+        print("traces are identical, {}".format(result["counters_a"]))
+        return
+    print("first difference at line {}".format(result["line"]))
+    for key in ["line_a", "line_b"]:
+        line = result[key]
+        print(
+            "  {}: {!r} {}".format(key, line, decode_trace_line(line) if line else "")
+        )
+    print("  counter deltas (b - a): {}".format(result["deltas"]))
+
+
+# same check on two RowIR objects, entries are compared in place, no expansion
+def diff_row_ir(ir_a, ir_b):
+    size = min(len(ir_a), len(ir_b))
+    columns = ["ops", "addr_a", "addr_b", "bubbles"]
+
+    def equal(lo, hi):
+        return all(
+            getattr(ir_a, name)[lo:hi] == getattr(ir_b, name)[lo:hi] for name in columns
+        )
+
+    if len(ir_a) == len(ir_b) and equal(0, size):
+        return None
+    lo = 0
+    hi = size
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if equal(lo, mid):
+            lo = mid
+        else:
+            hi = mid
+    if lo < size and equal(lo, lo + 1):
+        lo += 1
+    # first cache line of the differing entry
+    line = sum(ir_a.entry_requests(idx) for idx in range(lo)) + 1
+    entry_a = ir_a.expand_entry(lo)[0] if lo < len(ir_a) else None
+    entry_b = ir_b.expand_entry(lo)[0] if lo < len(ir_b) else None
+    return {"entry": lo, "line": line, "line_a": entry_a, "line_b": entry_b}
+
+
+if __name__ == "__main__":
+    # python trace_diff.py reference.trace candidate.trace
+    result = diff_traces(sys.argv[1], sys.argv[2])
+    print_diff(result)
+    sys.exit(0 if result["equal"] else 1)
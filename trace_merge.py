@@ -0,0 +1,211 @@
+import heapq
+import sys
+
+import address_helper as ah
+import converter as cv
+from trace_sink import TraceSink
+
+"""
+Multi-workload mixes: N single-stream traces merged into one, as the memory controller of a
+multi-core system sees them.
+    @ every row gets a timestamp, the cumulative bubble count plus one slot per earlier row
+      of its stream; a k-way heap merge emits rows in timestamp order
+    @ the merged bubble is the gap to the previous merged row, a row whose slot is already
+      taken by another stream is issued right after it (bubble 0, counted as a stall)
+    @ `group_rows` rows of a stream are kept together, 4 keeps the copy windows of the
+      extend4 layout intact for CMD4Window, 2 keeps the read/write pairs of a raw trace
+    @ per-stream address offsets and/or bank partitioning keep the workloads apart
+Each input is read one group at a time, so memory is constant per stream. Input rows may
+carry their bubble in the first field or in a single-field line before them, output uses
+single-field bubble lines like convert_to_cacheline reads them, or the first field.
+"""
+
+g_bank_shift = ah.g_assemble_levels_bits[4] + ah.g_assemble_levels_bits[3]
+
+
+class TraceStream:
+    def __init__(
+        self,
+        index: int,
+        file_path: str,
+        group_rows: int = 1,
+        addr_offset: int = 0,
+        banks: list = None,
+    ):
+        self.index = index
+        self.file_path = file_path
+        self.file = open(file_path, "r")
+        self.group_rows = group_rows
+        self.addr_offset = addr_offset
+        # banks this stream is confined to, None keeps its own banks
+        self.banks = banks
+        self.pending_bubble = 0
+        # slot of the next row without bubble
+        self.time = 0
+        self.rows = 0
+
+    def read_row(self):
+        for line in self.file:
+            items = line.split()
+            if not items:
+                continue
+            if len(items) == 1:
+                # bubble count line, belongs to the next row
+                self.pending_bubble += int(items[0])
+                continue
+            bubble = self.pending_bubble + int(items[0])
+            self.pending_bubble = 0
+            self.time += bubble
+            row = (self.time, items[1:])
+            self.time += 1
+            self.rows += 1
+            return row
+        return None
+
+    # list of (timestamp, fields without the bubble), empty at the end of the file
+    def next_group(self) -> list:
+        group = []
+        while len(group) < self.group_rows:
+            row = self.read_row()
+            if row is None:
+                break
+            group.append(row)
+        return group
+
+    def place(self, addr: int) -> int:
+        addr = ah.mask_address(ah.mask_address(addr) + self.addr_offset)
+        if self.banks is not None:
+            bank = (addr >> g_bank_shift) & (ah.g_bank_num - 1)
+            addr += (self.banks[bank % len(self.banks)] - bank) << g_bank_shift
+        return addr
+
+    def format_fields(self, fields: list) -> str:
+        if self.addr_offset == 0 and self.banks is None:
+            return " ".join(fields)
+        # "-1"/"-2" mark a write (DMA), every other field is an address
+        return " ".join(
+            field if field == "-1" or field == "-2" else str(self.place(int(field)))
+            for field in fields
+        )
+
+    def close(self):
+        self.file.close()
+
+
+# stream i gets an equal contiguous share of the banks
+def partition_banks(stream_num: int) -> list[list[int]]:
+    if stream_num > ah.g_bank_num:
+        raise Exception(
+            "Error: {} streams do not fit into {} banks".format(
+                stream_num, ah.g_bank_num
+            )
+        )
+    share = ah.g_bank_num // stream_num
+    return [list(range(idx * share, (idx + 1) * share)) for idx in range(stream_num)]
+
+
+def merge_traces(
+    file_paths: list[str],
+    output_path: str,
+    group_rows: int = 1,
+    addr_offsets: list[int] = None,
+    bank_partition: bool = False,
+    bubble_lines: bool = True,
+    make_fifo: bool = False,
+):
+    banks = partition_banks(len(file_paths)) if bank_partition else None
+    streams = [
+        TraceStream(
+            idx,
+            file_path,
+            group_rows,
+            addr_offsets[idx] if addr_offsets else 0,
+            banks[idx] if banks else None,
+        )
+        for idx, file_path in enumerate(file_paths)
+    ]
+    heap = []
+    for stream in streams:
+        group = stream.next_group()
+        if group:
+            # ties go to the lower stream index
+            heap.append((group[0][0], stream.index, group))
+    heapq.heapify(heap)
+    clock = 0
+    rows = 0
+    stalls = 0
+    stall_slots = 0
+    with TraceSink(output_path, make_fifo) as sink:
+        while heap:
+            _, index, group = heap[0]
+            stream = streams[index]
+            for timestamp, fields in group:
+                if timestamp >= clock:
+                    bubble = timestamp - clock
+                    clock = timestamp + 1
+                else:
+                    bubble = 0
+                    stalls += 1
+                    stall_slots += clock - timestamp
+                    clock += 1
+                if bubble_lines:
+                    if bubble:
+                        sink.write(str(bubble))
+                    sink.write("0 " + stream.format_fields(fields))
+                else:
+                    sink.write(str(bubble) + " " + stream.format_fields(fields))
+                rows += 1
+            group = stream.next_group()
+            if group:
+                heapq.heapreplace(heap, (group[0][0], index, group))
+            else:
+                heapq.heappop(heap)
+    for stream in streams:
+        stream.close()
+    return {
+        "rows": rows,
+        "stream_rows": [stream.rows for stream in streams],
+        "cycles": clock,
+        "stalls": stalls,
+        "stall_slots": stall_slots,
+        "lines": sink.lines_written,
+    }
+
+
+# merge extend4 traces and convert the mix into one cache line trace
+def merge_and_convert(
+    file_paths: list[str],
+    merged_path: str,
+    output_path: str,
+    alternative: bool = True,
+    replace_with_rowclone: bool = True,
+    group_rows: int = 4,
+    addr_offsets: list[int] = None,
+    bank_partition: bool = False,
+):
+    merged = merge_traces(
+        file_paths, merged_path, group_rows, addr_offsets, bank_partition
+    )
+    with TraceSink(output_path) as sink:
+        row_clone_count, total_request, _, _, error_row_clone = cv.convert_to_cacheline(
+            merged_path,
+            # the converter waits for `limit` rows, never ask for more than we have
+            merged["rows"],
+            alternative,
+            replace_with_rowclone,
+            sink=sink,
+        )
+    merged.update(
+        {
+            "row_clones": row_clone_count,
+            "total_request": total_request,
+            "error_row_clone": error_row_clone,
+            "cache_lines": sink.lines_written,
+        }
+    )
+    return merged
+
+
+if __name__ == "__main__":
+    # python trace_merge.py output.trace input1.trace input2.trace ...
+    print(merge_traces(sys.argv[2:], sys.argv[1]))
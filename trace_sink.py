@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+import stat
+import sys
+import time
+
+"""
+Output sinks for converted cache line traces. Instead of keeping all cache line requests
+in memory and saving them to output/ before Ramulator2 reads them back, a sink streams them
+    @ to a regular file
+    @ to a named pipe (FIFO), Ramulator2 or any consumer reads the other end
+    @ to stdout, use "-" as path, e.g. `python converter.py | ramulator2 ...`
+Lines are exactly the Ramulator2 trace format we save today: "<bubble> <addr>",
+"<bubble> -1 <addr>" and "0 <src> <dst>" for a rowclone.
+"""
+
+# default write buffer, big enough to hold several expanded rows
+g_sink_buffer_size = 1 << 20
+# how many lines we gather before one write call
+g_sink_batch_lines = 4096
+
+
+class TraceSink:
+    def __init__(
+        self,
+        path: str,
+        make_fifo: bool = False,
+        buffer_size: int = g_sink_buffer_size,
+        batch_lines: int = g_sink_batch_lines,
+        hasher=None,
+        append: bool = False,
+    ):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.batch_lines = batch_lines
+        self.pending = []
+        self.pending_bytes = 0
+        self.lines_written = 0
+        self.bytes_written = 0
+        # set when the consumer closed its end of the pipe
+        self.broken = False
+        # optional hashlib object, updated with every byte we write
+        self.hasher = hasher
+        # optional instrument.ConvertStats, times flushes and counts bytes
+        self.stats = None
+        self.file = None
+        self.owns_file = True
+        if path == "-":
+            self.file = sys.stdout
+            self.owns_file = False
+            return
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if make_fifo and not os.path.exists(path):
+            os.mkfifo(path)
+        # opening a FIFO for write blocks until a consumer opens it for read
+        self.file = open(path, "a" if append else "w", buffering=buffer_size)
+
+    def is_fifo(self) -> bool:
+        if not self.owns_file:
+            return False
+        return stat.S_ISFIFO(os.stat(self.path).st_mode)
+
+    def write(self, line: str):
+        self.pending.append(line)
+        self.pending_bytes += len(line) + 1
+        if len(self.pending) >= self.batch_lines:
+            self.flush_pending()
+
+    def extend(self, lines: list):
+        self.pending.extend(lines)
+        self.pending_bytes += sum(map(len, lines)) + len(lines)
+        if len(self.pending) >= self.batch_lines:
+            self.flush_pending()
+
+    def flush_pending(self):
+        if not self.pending or self.broken:
+            self.pending.clear()
+            self.pending_bytes = 0
+            return
+        if self.stats is not None:
+            start = time.perf_counter()
+        chunk = "\n".join(self.pending) + "\n"
+        try:
+            # a slow consumer simply blocks this write once the pipe buffer is full,
+            # which throttles the converter instead of growing memory
+            self.file.write(chunk)
+        except BrokenPipeError:
+            self.consumer_gone()
+            return
+        if self.hasher is not None:
+            self.hasher.update(chunk.encode())
+        self.lines_written += len(self.pending)
+        self.bytes_written += len(chunk)
+        self.pending.clear()
+        self.pending_bytes = 0
+        if self.stats is not None:
+            self.stats.bytes_written += len(chunk)
+            self.stats.write_time += time.perf_counter() - start
+
+    # push everything written so far to the file, e.g. before recording a checkpoint
+    def sync(self):
+        self.flush_pending()
+        if self.broken:
+            return
+        try:
+            self.file.flush()
+            if self.owns_file and not self.is_fifo():
+                os.fsync(self.file.fileno())
+        except BrokenPipeError:
+            self.consumer_gone()
+
+    # continue an output opened with append=True after a restart, whatever was written
+    # after the checkpoint at `offset` is dropped, the hasher does not cover old bytes
+    def resume(self, offset: int, lines: int):
+        if not self.owns_file or self.is_fifo():
+            raise Exception("Error: only a regular output file can be resumed")
+        self.flush_pending()
+        self.file.flush()
+        self.file.truncate(offset)
+        self.lines_written = lines
+        self.bytes_written = offset
+
+    def consumer_gone(self):
+        # consumer exited early, drop further output but keep converting counters sane
+        self.broken = True
+        self.pending.clear()
+        self.pending_bytes = 0
+        if self.owns_file:
+            try:
+                self.file.close()
+            except BrokenPipeError:
+                pass
+        else:
+            # avoid another EPIPE when the interpreter flushes stdout at exit
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            os.close(devnull)
+
+    def close(self):
+        self.flush_pending()
+        if self.broken:
+            return
+        try:
+            self.file.flush()
+            if self.owns_file:
+                self.file.close()
+        except BrokenPipeError:
+            self.consumer_gone()
+
+    def attach_stats(self, stats):
+        self.stats = stats
+
+    def total_lines(self) -> int:
+        return self.lines_written + len(self.pending)
+
+    def total_bytes(self) -> int:
+        return self.bytes_written + self.pending_bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+# cut the output into shards of about the same size, by output request count or bytes,
+# instead of a fixed number of input lines. The converter decides where a shard may end
+# (never inside a window) and reports input line range and counters for the manifest.
+class ShardedTraceSink:
+    def __init__(
+        self,
+        output_dir: str,
+        prefix: str = "slice",
+        target_requests: int = None,
+        target_bytes: int = None,
+    ):
+        if target_requests is None and target_bytes is None:
+            raise Exception("Error: sharding needs target requests or target bytes")
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.target_requests = target_requests
+        self.target_bytes = target_bytes
+        self.shards = []
+        # the next shard is opened by its first output, so a cut never leaves an empty one
+        self.sink = None
+        self.stats = None
+
+    def open_shard(self):
+        shard_file = "{}{}.trace".format(self.prefix, len(self.shards) + 1)
+        self.shard_file = shard_file
+        self.sink = TraceSink(
+            os.path.join(self.output_dir, shard_file), hasher=hashlib.sha256()
+        )
+        self.sink.stats = self.stats
+
+    def attach_stats(self, stats):
+        self.stats = stats
+        if self.sink is not None:
+            self.sink.stats = stats
+
+    def total_lines(self) -> int:
+        if self.sink is None:
+            return 0
+        return self.sink.total_lines()
+
+    def write(self, line: str):
+        if self.sink is None:
+            self.open_shard()
+        self.sink.write(line)
+
+    def extend(self, lines: list):
+        if self.sink is None:
+            self.open_shard()
+        self.sink.extend(lines)
+
+    def should_cut(self) -> bool:
+        if self.sink is None:
+            return False
+        if (
+            self.target_requests is not None
+            and self.sink.total_lines() >= self.target_requests
+        ):
+            return True
+        if (
+            self.target_bytes is not None
+            and self.sink.total_bytes() >= self.target_bytes
+        ):
+            return True
+        return False
+
+    # close current shard, input_start/input_end is the [start, end) input line range
+    def cut(self, input_start, input_end, row_clone_count, error_row_clone):
+        if self.sink is None and self.shards:
+            # no output since the previous cut, its shard takes the remaining rows
+            shard = self.shards[-1]
+            shard["input_end"] = input_end
+            shard["row_clone_count"] += row_clone_count
+            shard["error_row_clone"] += error_row_clone
+            return
+        if self.sink is None:
+            # nothing converted at all, still write one (empty) shard
+            self.open_shard()
+        self.sink.close()
+        self.shards.append(
+            {
+                "file": self.shard_file,
+                "input_start": input_start,
+                "input_end": input_end,
+                "requests": self.sink.lines_written,
+                "bytes": self.sink.bytes_written,
+                "row_clone_count": row_clone_count,
+                "error_row_clone": error_row_clone,
+                "sha256": self.sink.hasher.hexdigest(),
+            }
+        )
+        self.sink = None
+
+    def write_manifest(self, source: str, manifest_name: str = "manifest.json"):
+        manifest = {
+            "source": source,
+            "target_requests": self.target_requests,
+            "target_bytes": self.target_bytes,
+            "shards": self.shards,
+        }
+        manifest_path = os.path.join(self.output_dir, manifest_name)
+        with open(manifest_path, "w") as file:
+            json.dump(manifest, file, indent=2)
+        return manifest_path
+
+
+# dummy consumer, reads a streamed trace and counts requests like Ramulator2 would see them
+def consume_trace(path: str):
+    reads = 0
+    writes = 0
+    row_clones = 0
+    bubbles = 0
+    with open(path, "r") as file:
+        for line in file:
+            items = line.split()
+            bubbles += int(items[0])
+            if len(items) == 2:
+                reads += 1
+            elif items[1] == "-1" or items[1] == "-2":
+                writes += 1
+            else:
+                row_clones += 1
+    print(
+        "consumed reads {}, writes {}, row clones {}, bubbles {}".format(
+            reads, writes, row_clones, bubbles
+        )
+    )
+    return reads, writes, row_clones, bubbles
+
+
+if __name__ == "__main__":
+    # python trace_sink.py <fifo or file>, use /dev/stdin to consume a pipe
+    consume_trace(sys.argv[1])
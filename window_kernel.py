@@ -0,0 +1,210 @@
+import math
+
+import numpy as np
+
+import address_helper as ah
+from row_ir import IROp, RowIR
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+"""
+CMD4Window as one loop over typed arrays instead of a Python method call per
+row, compiled with Numba when it is installed:
+    @ input rows are three columns: op (0 read, 1 write), row address, bubble
+    @ subarray keys are computed up front, by shift or vectorized by an address_mapping
+    @ output is RowIR columns, expanded to cache lines by the usual RowIR writer
+Rows are fed in chunks; the last 3 rows of a chunk may still start a copy window, so they
+are carried into the next chunk. Without Numba the converters keep the CMD4Window path,
+window4_kernel itself stays plain Python code and runs interpreted when called directly.
+"""
+
+g_has_numba = numba is not None
+g_row_read = 0
+g_row_write = 1
+# IROp values as plain ints, Numba does not read class attributes
+g_ir_read = IROp.READ
+g_ir_write = IROp.WRITE
+g_ir_dma_write = IROp.DMA_WRITE
+g_ir_pair = IROp.PAIR
+g_ir_rc = IROp.RC
+g_row_mask = ~((1 << ah.g_assemble_levels_bits[4]) - 1)
+g_subarray_mask_bits = ah.g_assemble_levels_bits[4] + int(math.log2(ah.g_subarray_size))
+
+
+# Same decisions as CMD4Window.handle() for every window start i:
+#   @ copy window: rows i..i+3 are write/read/write/read with matching addresses
+#   @ otherwise row i alone in normal mode
+# final=False stops once fewer than 4 rows are left, they go into the next chunk.
+# A window starting at or after last_start is the last one handled, the rows after it are
+# dropped like at the end of a bulk_convert_to_cacheline slice.
+# returns (rows consumed, entries written, rowclones, error rowclones)
+def window4_kernel(
+    ops,
+    addrs,
+    keys,
+    bubbles,
+    count,
+    final,
+    last_start,
+    alternative,
+    replace_with_rowclone,
+    out_ops,
+    out_a,
+    out_b,
+    out_bubbles,
+):
+    i = 0
+    entries = 0
+    row_clone_count = 0
+    error_row_clone = 0
+    while i < count:
+        full = i + 4 <= count
+        if not full and not final:
+            break
+        start = i
+        if (
+            full
+            and ops[i] == g_row_write
+            and ops[i + 1] == g_row_read
+            and addrs[i] == addrs[i + 1]
+            and ops[i + 2] == g_row_write
+            and ops[i + 3] == g_row_read
+            and addrs[i + 2] == addrs[i + 3]
+        ):
+            out_ops[entries] = g_ir_dma_write
+            out_a[entries] = addrs[i] & g_row_mask
+            out_b[entries] = -1
+            out_bubbles[entries] = bubbles[i]
+            entries += 1
+            rd_addr = addrs[i + 1]
+            wr_addr = addrs[i + 2]
+            if replace_with_rowclone and keys[i + 1] == keys[i + 2]:
+                if rd_addr == wr_addr:
+                    error_row_clone += 1
+                else:
+                    out_ops[entries] = g_ir_rc
+                    out_a[entries] = rd_addr
+                    out_b[entries] = wr_addr
+                    out_bubbles[entries] = 0
+                    entries += 1
+                    row_clone_count += 1
+            elif alternative:
+                out_ops[entries] = g_ir_pair
+                out_a[entries] = rd_addr & g_row_mask
+                out_b[entries] = wr_addr & g_row_mask
+                out_bubbles[entries] = 0
+                entries += 1
+            else:
+                out_ops[entries] = g_ir_read
+                out_a[entries] = rd_addr & g_row_mask
+                out_b[entries] = -1
+                out_bubbles[entries] = bubbles[i + 1]
+                entries += 1
+                out_ops[entries] = g_ir_write
+                out_a[entries] = wr_addr & g_row_mask
+                out_b[entries] = -1
+                out_bubbles[entries] = bubbles[i + 2]
+                entries += 1
+            out_ops[entries] = g_ir_read
+            out_a[entries] = addrs[i + 3] & g_row_mask
+            out_b[entries] = -1
+            out_bubbles[entries] = bubbles[i + 3]
+            entries += 1
+            i += 4
+        else:
+            out_ops[entries] = g_ir_read if ops[i] == g_row_read else g_ir_write
+            out_a[entries] = addrs[i] & g_row_mask
+            out_b[entries] = -1
+            out_bubbles[entries] = bubbles[i]
+            entries += 1
+            i += 1
+        if start >= last_start:
+            break
+    return i, entries, row_clone_count, error_row_clone
+
+
+if g_has_numba:
+    window4_kernel_jit = numba.njit(cache=True)(window4_kernel)
+else:
+    window4_kernel_jit = window4_kernel
+
+
+class KernelWindow:
+    def __init__(
+        self,
+        alternative: bool,
+        replace_with_rowclone: bool,
+        mapping=None,
+        kernel=window4_kernel_jit,
+    ):
+        self.alternative = alternative
+        self.replace_with_rowclone = replace_with_rowclone
+        self.mapping = mapping
+        self.kernel = kernel
+        # rows of the previous chunk that were not handled yet
+        self.carry = (
+            np.zeros(0, dtype=np.int8),
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int64),
+        )
+        self.row_count = 0
+        self.handled_rows = 0
+        self.row_clone_count = 0
+        self.error_row_clone = 0
+
+    def subarray_keys(self, addrs):
+        if self.mapping is None:
+            return addrs >> g_subarray_mask_bits
+        return self.mapping.subarray_key_array(addrs)
+
+    # feed rows, their entries are appended to ir
+    def run(
+        self,
+        ops: list,
+        addrs: list,
+        bubbles: list,
+        ir: RowIR,
+        final: bool = False,
+        last_start: int = None,
+    ):
+        self.row_count += len(ops)
+        ops = np.concatenate([self.carry[0], np.array(ops, dtype=np.int8)])
+        addrs = np.concatenate([self.carry[1], np.array(addrs, dtype=np.int64)])
+        bubbles = np.concatenate([self.carry[2], np.array(bubbles, dtype=np.int64)])
+        count = len(ops)
+        # a copy window turns 4 rows into at most 4 entries
+        out_ops = np.empty(count, dtype=np.int8)
+        out_a = np.empty(count, dtype=np.int64)
+        out_b = np.empty(count, dtype=np.int64)
+        out_bubbles = np.empty(count, dtype=np.int64)
+        consumed, entries, row_clone_count, error_row_clone = self.kernel(
+            ops,
+            addrs,
+            self.subarray_keys(addrs),
+            bubbles,
+            count,
+            final,
+            count if last_start is None else last_start,
+            self.alternative,
+            self.replace_with_rowclone,
+            out_ops,
+            out_a,
+            out_b,
+            out_bubbles,
+        )
+        ir.extend(
+            out_ops[:entries].tolist(),
+            out_a[:entries].tolist(),
+            out_b[:entries].tolist(),
+            out_bubbles[:entries].tolist(),
+        )
+        self.carry = (ops[consumed:], addrs[consumed:], bubbles[consumed:])
+        if final:
+            # rows after the last handled window are dropped
+            self.carry = (ops[:0], addrs[:0], bubbles[:0])
+        self.handled_rows += consumed
+        self.row_clone_count += row_clone_count
+        self.error_row_clone += error_row_clone